@@ -9,6 +9,9 @@ structure and create new packets for testing or modding.
 The Huffman encoding uses a static frequency table built from captured game traffic
 to achieve ~40-60% compression on typical game packets.
 
+NumPy is optional. When it is installed, long inputs are encoded with a
+vectorized engine (see ENCODE_ENGINES); otherwise everything is pure Python.
+
 Usage:
     # Decode a packet
     codec = HuffmanCodec()
@@ -17,12 +20,47 @@ Usage:
     # Encode a packet
     compressed = codec.compress(scene_packet_bytes)
     full_packet = codec.encode_full_packet(scene_packet_bytes, client_id=0x7c)
+    
+    # Codecs are immutable after construction: share one across threads
+    pool.map(codec.decompress, payloads)
+    
+    # Use the reference bit-by-bit tree walk instead of the lookup table decoder
+    codec = HuffmanCodec(decode_engine="tree")
+    
+    # Count packets, bytes, symbols, errors and latencies (off by default)
+    stats = codec.enable_stats()
+    print(stats.snapshot())
+    
+    # Memoize results for byte-identical packets (keepalives, acks)
+    compress_cache, decompress_cache = codec.enable_cache(max_entries=1024)
+    
+    # Bound the work spent on untrusted packets (raises DecompressionLimitError);
+    # with a limit, headers the encoder never writes are rejected too
+    decompressed = codec.decompress(compressed_bytes, max_output=4096)
+    
+    # Decode incoming packets on worker processes, sharded by client id
+    from huffman_bs_shard import ClientShardDispatcher
+    with ClientShardDispatcher(workers=4, handler=handle_scene_packet) as dispatcher:
+        dispatcher.dispatch(packet)
 
 Based on Ballistica source code:
     src/ballistica/scene_v1/support/huffman.cc
     src/ballistica/base/networking/networking.h
 """
 
+import array
+import collections
+import random
+import sys
+import threading
+import time
+
+import huffman_bs_min
+
+# NumPy, imported by _numpy() the first time the "numpy" or "auto" encode
+# engine gets a long enough input (False if it is not installed)
+np = None
+
 # ============================================================================
 # PACKET TYPE DEFINITIONS (from networking.h)
 # ============================================================================
@@ -59,6 +97,12 @@ BA_PACKET_DISCONNECT_FROM_HOST_ACK = 35
 BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED = 36
 BA_PACKET_HOST_GAMEPACKET_COMPRESSED = 37
 
+# Packet types of compressed game packets (both directions)
+GAMEPACKET_TYPES = (
+    BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED,
+    BA_PACKET_HOST_GAMEPACKET_COMPRESSED,
+)
+
 # Scene packet types (first byte after decompression)
 # These are game-level packets that sit inside the compressed UDP packets
 BA_SCENEPACKET_HANDSHAKE = 15
@@ -164,6 +208,12 @@ MESSAGE_TYPES = {
     21: "BA_MESSAGE_CLIENT_PLAYER_PROFILES_JSON",
 }
 
+# Offset of the message type byte in scene packets that carry a message
+MESSAGE_TYPE_OFFSETS = {
+    BA_SCENEPACKET_MESSAGE: 6,
+    BA_SCENEPACKET_MESSAGE_UNRELIABLE: 8,
+}
+
 # ============================================================================
 # HUFFMAN CODEC IMPLEMENTATION
 # ============================================================================
@@ -190,15 +240,474 @@ G_FREQS = [
 ]
 
 
+# Bits looked up at once by the "table" decode engine. 9 bits holds every
+# symbol the encoder emits (longest huffman code is 8 bits, raw value is 9)
+# and always fits in the two bytes the decoder reads per lookup.
+DECODE_WINDOW_BITS = 9
+
+# Available decoders for HuffmanCodec(decode_engine=...)
+DECODE_ENGINES = ("tree", "table", "compiled")
+
+# Bits the "compiled" decode engine reads at once (three bytes shifted by up
+# to 7 bits). Symbols whose tree path is longer are left to the tree walk.
+COMPILED_WINDOW_BITS = 17
+
+# Result of HuffmanCodec.peek()
+PeekResult = collections.namedtuple("PeekResult", "compressed remainder data")
+
+# Available encoders for HuffmanCodec(encode_engine=...). "numpy" and "auto"
+# fall back to "python" when NumPy is not installed.
+ENCODE_ENGINES = ("python", "numpy", "auto")
+
+# Shortest packet the "auto" encode engine hands to NumPy. Below this the
+# array setup costs more than the pure-Python loop (e.g. 13-15 byte inputs).
+NUMPY_MIN_LENGTH = 160
+
+# Tree nodes and code tables shared by all codecs, keyed by frequency table.
+# Shared tables are immutable (tuples and read-only memoryviews).
+_TABLE_CACHE = {}
+_SHARED_TABLES = (
+    "left_child", "right_child", "parent", "frequency",
+    "code_bits", "code_vals", "decode_table",
+)
+
+# Read-only NumPy (code_bits, code_vals) arrays of the "numpy" encode engine,
+# keyed by frequency table and built on first use
+_NUMPY_TABLE_CACHE = {}
+
+# Code objects of the "compiled" decode engine, keyed by frequency table
+_DECODER_CODE_CACHE = {}
+
+# Held while filling _TABLE_CACHE or _DECODER_CODE_CACHE, so codecs created
+# by several threads at once build each table only once
+_CACHE_LOCK = threading.Lock()
+
+
+# Frequency table whose codes huffman_bs_min embeds precomputed
+_MIN_FREQS = tuple(huffman_bs_min.GF())
+
+
+def _numpy():
+    """Import NumPy on first use; returns None if it is not installed."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:  # Optional, only used by the "numpy" encode engine
+            numpy = False
+        np = numpy
+    return np or None
+
+
+def _build_tree(freqs):
+    """
+    Build the Huffman tree and codes of a frequency table (see HuffmanCodec.build).
+    
+    Returns:
+        Lists (left, right, parent, frequency, code_bits, code_vals)
+    """
+    # Initialize leaf node frequencies
+    frequency = list(freqs) + [0] * 255
+    left = [-1] * 511
+    right = [-1] * 511
+    parent = [0] * 511
+    
+    # Non-parented nodes in index order, so the search below visits the
+    # same candidates in the same order as a scan over all nodes
+    roots = list(range(256))
+    node_count = 256
+    
+    # Build tree by repeatedly combining two smallest nodes
+    while node_count < 511:
+        # Start from the first two non-parented nodes
+        smallest1, smallest2 = roots[0], roots[1]
+        freq1, freq2 = frequency[smallest1], frequency[smallest2]
+        
+        # Find the two smallest frequencies
+        for i in roots[2:]:
+            freq = frequency[i]
+            if freq1 > freq2:
+                if freq < freq1:
+                    smallest1, freq1 = i, freq
+            else:
+                if freq < freq2:
+                    smallest2, freq2 = i, freq
+        roots.remove(smallest1)
+        roots.remove(smallest2)
+        roots.append(node_count)
+        
+        # Create parent node
+        frequency[node_count] = frequency[smallest1] + frequency[smallest2]
+        parent[smallest1] = node_count - 255
+        parent[smallest2] = node_count - 255
+        right[node_count] = smallest1
+        left[node_count] = smallest2
+        
+        node_count += 1
+    
+    # Build encoding bit patterns for each byte value
+    code_bits = [0] * 256
+    code_vals = [0] * 256
+    for i in range(256):
+        val = 0
+        bits = 0
+        index = i
+        
+        # Walk up tree to build bit pattern
+        while parent[index] != 0:
+            parent_idx = parent[index] + 255
+            # Right child = 1, left child = 0
+            if right[parent_idx] == index:
+                val = (val << 1) | 0x01
+            else:
+                val = val << 1
+            bits += 1
+            index = parent_idx
+        
+        # Add prefix bit: 1 = huffman encoded, 0 = raw 8-bit value
+        # If huffman encoding would be >= 8 bits, just use raw value
+        if bits >= 8:
+            bits = 8
+            val = i << 1  # Raw value with 0 prefix
+        else:
+            val = (val << 1) | 0x01  # Huffman with 1 prefix
+        code_bits[i] = bits + 1
+        code_vals[i] = val
+    
+    return left, right, parent, frequency, code_bits, code_vals
+
+
+def min_code_literal(freqs=G_FREQS):
+    """
+    Return the huffman_bs_min.C literal (the non-raw codes) for a table.
+    
+    huffman_bs_min embeds this for G_FREQS so it can start without building
+    the tree; regenerate it with this function if the table ever changes.
+    """
+    codec = HuffmanCodec(freqs=freqs)
+    codes = ",".join(
+        f"{byte}:({bits},{codec.code_vals[byte]})"
+        for byte, bits in enumerate(codec.code_bits) if bits < 9
+    )
+    return "C = {" + codes + "}"
+
+
+def _check_min_tables(codec):
+    """
+    Make sure huffman_bs_min's precomputed tables match a freshly built
+    _MIN_FREQS codec, as both modules run the same kernels on them.
+    
+    Raises:
+        RuntimeError: If huffman_bs_min.C is out of date
+    """
+    if (huffman_bs_min.B, huffman_bs_min.V, huffman_bs_min.T) != (
+            codec.code_bits, codec.code_vals, codec.decode_table):
+        raise RuntimeError(
+            "huffman_bs_min.C does not match its frequency table; "
+            "regenerate it with huffman_bs.min_code_literal()"
+        )
+
+
 class Node:
-    """Huffman tree node for encoding/decoding"""
+    """
+    Read-only view of one Huffman tree node.
+    
+    The tree is stored in flat arrays on the codec (left_child, right_child,
+    parent, frequency, code_bits, code_vals); codec.nodes[i] returns a Node
+    reading node i from them.
+    """
+    __slots__ = ("_codec", "_index")
+    
+    def __init__(self, codec, index):
+        self._codec = codec
+        self._index = index
+    
+    def __repr__(self):
+        return (f"<Node {self._index} left={self.left_child} right={self.right_child} "
+                f"bits={self.bits} val={self.val:#x}>")
+    
+    @property
+    def left_child(self):
+        """Index of left child node (-1 = none)"""
+        return self._codec.left_child[self._index]
+    
+    @property
+    def right_child(self):
+        """Index of right child node (-1 = none)"""
+        return self._codec.right_child[self._index]
+    
+    @property
+    def parent(self):
+        """Parent index (0 = none, add 255 for actual index)"""
+        return self._codec.parent[self._index]
+    
+    @property
+    def bits(self):
+        """Number of bits in encoded value (leaf nodes only, else 0)"""
+        return self._codec.code_bits[self._index] if self._index < 256 else 0
+    
+    @property
+    def val(self):
+        """Encoded bit pattern (leaf nodes only, else 0)"""
+        return self._codec.code_vals[self._index] if self._index < 256 else 0
+    
+    @property
+    def frequency(self):
+        """Frequency count used for tree building"""
+        return self._codec.frequency[self._index]
+
+
+class _NodeList:
+    """Read-only sequence of the 511 tree nodes of a codec (see Node)"""
+    __slots__ = ("_codec",)
+    
+    def __init__(self, codec):
+        self._codec = codec
+    
+    def __len__(self):
+        return 511
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Node(self._codec, i) for i in range(511)[index]]
+        return Node(self._codec, range(511)[index])
+
+
+def _iter_packets(packets, offsets):
+    """Yield each packet of a list, or of a buffer split at offsets"""
+    if offsets is None:
+        return iter(packets)
+    view = memoryview(packets)
+    return (view[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1))
+
+
+def _reserve(output, pos, size):
+    """Grow bytearray output (geometrically) so size bytes fit at pos"""
+    if pos + size > len(output):
+        output.extend(bytes(max(pos + size - len(output), len(output))))
+
+
+def _byte_view(buffer):
+    """Return buffer as something writable per byte (bytearray or memoryview)"""
+    if type(buffer) is bytearray:
+        return buffer
+    view = memoryview(buffer)
+    if view.readonly:
+        raise TypeError("Output buffer must be writable")
+    if view.format != "B" or view.ndim != 1:
+        view = view.cast("B")
+    return view
+
+
+class DecompressionLimitError(ValueError):
+    """A decompress call would exceed its max_output or max_bits limit"""
+
+
+class CodecStats:
+    """
+    Counters collected by HuffmanCodec.enable_stats().
+    
+    Calls are counted per operation ("compress" also covers compress_into(),
+    encode_full_packet() and encode_full_packet_into(), "decompress" also
+    covers decompress_into()).
+    Per operation this tracks:
+    - packets, bytes_in, bytes_out: successful calls and their sizes
+    - uncompressed: packets passed through as-is (compress: the codes would
+      not have been shorter than the input; decompress: compression flag clear)
+    - raw_symbols, huffman_symbols: bytes carried as raw 8-bit values vs
+      huffman codes (only counted for compressed packets)
+    - errors: failed calls by kind: the message of the codec's own
+      ValueErrors (see ERROR_MESSAGES), else the exception type (e.g.
+      IndexError for truncated data, DecompressionLimitError), so the
+      number of kinds stays bounded
+    - latency: call durations bucketed by power-of-two nanoseconds; a call
+      is counted in the first bucket whose upper bound exceeds it
+    
+    Updates are locked, so one CodecStats can be shared by codecs (or one
+    codec) used from several threads.
+    """
+    
+    OPERATIONS = ("compress", "decompress")
+    
+    # Fixed messages of the ValueErrors raised by the codec. Any other
+    # ValueError (whose message may hold per-packet values) is counted as
+    # "ValueError".
+    ERROR_MESSAGES = frozenset({
+        "Empty data",
+        "First byte must have high bit clear (required for compression flag)",
+        "Invalid huffman data: remainder > bit_length",
+        "Invalid huffman data: reserved header bits set",
+        "Invalid huffman data: remainder >= 8",
+        "Bit position exceeded bit_length during huffman decode",
+        "Bit position exceeded bit_length during raw read",
+        "Output buffer too small",
+        "Output buffer too small for packet header",
+    })
+    
     def __init__(self):
-        self.left_child = -1      # Index of left child node (-1 = none)
-        self.right_child = -1     # Index of right child node (-1 = none)
-        self.parent = 0           # Parent index (0 = none, add 255 for actual index)
-        self.bits = 0             # Number of bits in encoded value
-        self.val = 0              # Encoded bit pattern
-        self.frequency = 0        # Frequency count for tree building
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    def reset(self):
+        """Zero every counter"""
+        with self._lock:
+            self.counters = {op: collections.Counter() for op in self.OPERATIONS}
+            self.errors = {op: collections.Counter() for op in self.OPERATIONS}
+            self.latency = {op: collections.Counter() for op in self.OPERATIONS}
+            self.latency_sum_ns = collections.Counter()
+    
+    def record(self, op, bytes_in, bytes_out, uncompressed, raw_symbols, symbols, elapsed_ns):
+        """Count one successful call of op"""
+        with self._lock:
+            counters = self.counters[op]
+            counters["packets"] += 1
+            counters["bytes_in"] += bytes_in
+            counters["bytes_out"] += bytes_out
+            if uncompressed:
+                counters["uncompressed"] += 1
+            else:
+                counters["raw_symbols"] += raw_symbols
+                counters["huffman_symbols"] += symbols - raw_symbols
+            self.latency[op][1 << elapsed_ns.bit_length()] += 1
+            self.latency_sum_ns[op] += elapsed_ns
+    
+    def record_error(self, op, error, elapsed_ns):
+        """Count one failed call of op"""
+        kind = type(error).__name__
+        if kind == "ValueError" and str(error) in self.ERROR_MESSAGES:
+            kind = str(error)
+        with self._lock:
+            self.errors[op][kind] += 1
+            self.latency[op][1 << elapsed_ns.bit_length()] += 1
+            self.latency_sum_ns[op] += elapsed_ns
+    
+    def snapshot(self):
+        """
+        Copy the current counters into plain dicts.
+        
+        Returns:
+            Dict of operation -> {"packets", "bytes_in", "bytes_out",
+            "uncompressed", "raw_symbols", "huffman_symbols", "errors":
+            {kind: count}, "latency_ns": {"count", "sum", "buckets":
+            {upper bound: count}}}, ready for json.dumps() or an exporter
+        """
+        with self._lock:
+            result = {}
+            for op in self.OPERATIONS:
+                counters = self.counters[op]
+                buckets = self.latency[op]
+                result[op] = {
+                    "packets": counters["packets"],
+                    "bytes_in": counters["bytes_in"],
+                    "bytes_out": counters["bytes_out"],
+                    "uncompressed": counters["uncompressed"],
+                    "raw_symbols": counters["raw_symbols"],
+                    "huffman_symbols": counters["huffman_symbols"],
+                    "errors": dict(self.errors[op]),
+                    "latency_ns": {
+                        "count": sum(buckets.values()),
+                        "sum": self.latency_sum_ns[op],
+                        "buckets": dict(sorted(buckets.items())),
+                    },
+                }
+            return result
+
+
+class PacketCache:
+    """
+    Bounded LRU map of packet bytes to a codec result.
+    
+    Used by HuffmanCodec.enable_cache() to skip the bit work for
+    byte-identical packets (keepalives, idle input commands, acks).
+    Inputs longer than max_key_length bypass the cache without being copied
+    or hashed. Entries are evicted least recently used first once either
+    max_entries or max_bytes (keys plus values) is exceeded.
+    
+    stats counts hits, misses, bypassed lookups and evictions. Lookups and
+    updates are locked, so a cache can be shared across threads.
+    """
+    
+    def __init__(self, max_entries=1024, max_bytes=1 << 20, max_key_length=128):
+        """
+        Args:
+            max_entries: Most packets kept
+            max_bytes: Most key plus value bytes kept
+            max_key_length: Longest input looked up or stored
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_key_length = max_key_length
+        self.stats = collections.Counter()
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def clear(self):
+        """Drop every entry (stats are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+    
+    def get(self, data):
+        """
+        Look up the cached result for data.
+        
+        Returns:
+            Cached result, or None on a miss or if data is too long
+        """
+        if len(data) > self.max_key_length:
+            with self._lock:
+                self.stats["bypassed"] += 1
+            return None
+        key = data if type(data) is bytes else bytes(data)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+    
+    def put(self, data, value):
+        """Store value (bytes) as the result for data, evicting as needed"""
+        if len(data) > self.max_key_length:
+            return
+        size = len(data) + len(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        key = data if type(data) is bytes else bytes(data)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(key) + len(old)
+            self._entries[key] = value
+            self.nbytes += size
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                key, old = self._entries.popitem(last=False)
+                self.nbytes -= len(key) + len(old)
+                self.stats["evictions"] += 1
 
 
 class HuffmanCodec:
@@ -206,7 +715,15 @@ class HuffmanCodec:
     Huffman codec for BombSquad/Ballistica network packets.
     
     Implements the same Huffman compression algorithm used by the game engine.
-    The codec uses a pre-built frequency table from captured game traffic.
+    The codec uses a pre-built frequency table from captured game traffic
+    (G_FREQS, the table the game uses) unless another table is given.
+    The Huffman tree is only built by the first codec for a frequency table;
+    later codecs share it, so creating a codec per packet is cheap.
+    
+    The tables are immutable once built and calls keep no state on the
+    codec, so one codec can be shared by any number of threads. Call
+    enable_stats()/enable_cache() before sharing it; the stats and caches
+    they install are locked.
     
     Key features:
     - Compresses only if result is smaller than original
@@ -214,10 +731,82 @@ class HuffmanCodec:
     - Supports both Huffman-encoded and raw 8-bit values in bitstream
     """
     
-    def __init__(self):
-        """Initialize codec and build Huffman tree"""
-        self.nodes = [Node() for _ in range(511)]
-        self.build()
+    # CodecStats while enable_stats() is active, else None
+    stats = None
+    
+    # PacketCaches used by compress()/decompress() after enable_cache(), else None
+    compress_cache = None
+    decompress_cache = None
+    
+    def __init__(self, decode_engine="table", encode_engine="auto", freqs=None):
+        """
+        Initialize codec and build Huffman tree.
+        
+        Args:
+            decode_engine: Decoder used by decompress(), one of DECODE_ENGINES
+                ("table" = multi-bit lookup table, "tree" = bit-by-bit tree walk,
+                "compiled" = branches generated from the tree, see decoder_source())
+            encode_engine: Encoder used by compress(), one of ENCODE_ENGINES
+                ("python" = bit accumulator loop, "numpy" = vectorized,
+                "auto" = NumPy for inputs of NUMPY_MIN_LENGTH bytes or more)
+            freqs: Byte frequency table (256 non-negative ints) to build the
+                tree from (default: G_FREQS). Both ends must use the same table.
+        """
+        if decode_engine not in DECODE_ENGINES:
+            raise ValueError(f"Unknown decode engine: {decode_engine!r}")
+        if encode_engine not in ENCODE_ENGINES:
+            raise ValueError(f"Unknown encode engine: {encode_engine!r}")
+        self.decode_engine = decode_engine
+        self.encode_engine = encode_engine
+        self.freqs = tuple(G_FREQS if freqs is None else freqs)
+        
+        # The tree and code tables only depend on the frequency table, so they
+        # are built once and shared by every codec using the same table
+        tables = _TABLE_CACHE.get(self.freqs)
+        if tables is None:
+            if len(self.freqs) != 256 or any(f < 0 for f in self.freqs):
+                raise ValueError("Frequency table must hold 256 non-negative counts")
+            with _CACHE_LOCK:
+                tables = _TABLE_CACHE.get(self.freqs)
+                if tables is None:
+                    self.build()
+                    if self.freqs == _MIN_FREQS:
+                        _check_min_tables(self)
+                    tables = {name: getattr(self, name) for name in _SHARED_TABLES}
+                    _TABLE_CACHE[self.freqs] = tables
+        self.__dict__.update(tables)
+        self._select_decoder()
+        
+        # Inputs at least this long are encoded with NumPy (imported lazily,
+        # see _numpy_symbols())
+        if np is False or encode_engine == "python":
+            self.numpy_min_length = float("inf")
+        elif encode_engine == "numpy":
+            self.numpy_min_length = 0
+        else:
+            self.numpy_min_length = NUMPY_MIN_LENGTH
+    
+    def _select_decoder(self):
+        if self.decode_engine == "table":
+            self._decode = self._decode_table
+        elif self.decode_engine == "compiled":
+            self._decode = self._compiled_decoder()
+        else:
+            self._decode = self._decode_tree
+    
+    def __getstate__(self):
+        # The shared tables and the decoder are looked up again on unpickling
+        state = self.__dict__.copy()
+        for name in _SHARED_TABLES + ("_decode",):
+            state.pop(name, None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.freqs not in _TABLE_CACHE:
+            HuffmanCodec(freqs=self.freqs)
+        self.__dict__.update(_TABLE_CACHE[self.freqs])
+        self._select_decoder()
     
     def build(self):
         """
@@ -227,73 +816,149 @@ class HuffmanCodec:
         - Nodes 0-255: Leaf nodes representing bytes
         - Nodes 256-510: Internal nodes
         - Node 510: Root node
+        
+        The tree is stored as flat arrays indexed by node (left_child,
+        right_child, parent: read-only int16 memoryviews; frequency: tuple)
+        and each byte's code as code_bits/code_vals tuples, see Node for the
+        fields. None of the tables can be modified after build().
         """
-        # Initialize leaf node frequencies
-        for i in range(256):
-            self.nodes[i].frequency = G_FREQS[i]
-        
-        node_count = 256
-        
-        # Build tree by repeatedly combining two smallest nodes
-        while node_count < 511:
-            # Find first two non-parented nodes
-            i = 0
-            while self.nodes[i].parent != 0:
-                i += 1
-            smallest1 = i
-            i += 1
-            while self.nodes[i].parent != 0:
-                i += 1
-            smallest2 = i
-            i += 1
-            
-            # Find the two smallest frequencies
-            while i < node_count:
-                if self.nodes[i].parent == 0:
-                    if self.nodes[smallest1].frequency > self.nodes[smallest2].frequency:
-                        if self.nodes[i].frequency < self.nodes[smallest1].frequency:
-                            smallest1 = i
-                    else:
-                        if self.nodes[i].frequency < self.nodes[smallest2].frequency:
-                            smallest2 = i
-                i += 1
-            
-            # Create parent node
-            self.nodes[node_count].frequency = (
-                self.nodes[smallest1].frequency + self.nodes[smallest2].frequency
-            )
-            self.nodes[smallest1].parent = node_count - 255
-            self.nodes[smallest2].parent = node_count - 255
-            self.nodes[node_count].right_child = smallest1
-            self.nodes[node_count].left_child = smallest2
-            
-            node_count += 1
-        
-        # Build encoding bit patterns for each byte value
-        for i in range(256):
-            self.nodes[i].val = 0
-            self.nodes[i].bits = 0
-            index = i
-            
-            # Walk up tree to build bit pattern
-            while self.nodes[index].parent != 0:
-                parent_idx = self.nodes[index].parent + 255
-                # Right child = 1, left child = 0
-                if self.nodes[parent_idx].right_child == index:
-                    self.nodes[i].val = (self.nodes[i].val << 1) | 0x01
+        left, right, parent, frequency, code_bits, code_vals = _build_tree(self.freqs)
+        
+        self.left_child = memoryview(array.array("h", left)).toreadonly()
+        self.right_child = memoryview(array.array("h", right)).toreadonly()
+        self.parent = memoryview(array.array("h", parent)).toreadonly()
+        self.frequency = tuple(frequency)
+        
+        # The encoder indexes these per input byte; tuples index faster than arrays
+        self.code_bits = tuple(code_bits)
+        self.code_vals = tuple(code_vals)
+        
+        self.build_decode_table()
+    
+    @property
+    def nodes(self):
+        """Read-only sequence of the tree's 511 nodes (see Node)"""
+        return _NodeList(self)
+    
+    def build_decode_table(self):
+        """
+        Build the lookup table used by the "table" decode engine.
+        
+        The table is indexed by the next DECODE_WINDOW_BITS bits of the stream
+        (LSB first) and resolves one whole symbol per lookup. Each entry is
+        (symbol_bits << 8) | byte_value, or 0 if the window does not hold a
+        complete symbol (only possible for malformed tree paths deeper than
+        the window, which are left to the tree walk).
+        """
+        left = self.left_child
+        right = self.right_child
+        table = [0] * (1 << DECODE_WINDOW_BITS)
+        
+        for window in range(1 << DECODE_WINDOW_BITS):
+            if not window & 1:
+                # Raw 8-bit value after a 0 prefix bit
+                table[window] = (9 << 8) | ((window >> 1) & 0xFF)
+                continue
+            
+            # Huffman-encoded value: walk tree exactly like _decode_tree()
+            n = 510
+            bit = 1
+            val = None
+            while bit < DECODE_WINDOW_BITS:
+                bitval = (window >> bit) & 1
+                if bitval == 0:
+                    if left[n] == -1:
+                        val = n
+                        break
+                    n = left[n]
                 else:
-                    self.nodes[i].val = self.nodes[i].val << 1
-                self.nodes[i].bits += 1
-                index = parent_idx
-            
-            # Add prefix bit: 1 = huffman encoded, 0 = raw 8-bit value
-            # If huffman encoding would be >= 8 bits, just use raw value
-            if self.nodes[i].bits >= 8:
-                self.nodes[i].bits = 8
-                self.nodes[i].val = i << 1  # Raw value with 0 prefix
-            else:
-                self.nodes[i].val = (self.nodes[i].val << 1) | 0x01  # Huffman with 1 prefix
-            self.nodes[i].bits += 1
+                    if right[n] == -1:
+                        val = n
+                        break
+                    n = right[n]
+                bit += 1
+                if left[n] == -1 and right[n] == -1:
+                    val = n
+                    break
+            
+            if val is not None:
+                table[window] = (bit << 8) | (val & 0xFF)
+        
+        self.decode_table = tuple(table)
+    
+    def decoder_source(self):
+        """
+        Generate the Python source of the "compiled" decode engine.
+        
+        The Huffman tree is unrolled into nested branches on the bits of a
+        COMPILED_WINDOW_BITS wide window, with every leaf turned into a
+        constant store, so decoding a symbol needs no node lookups. The
+        generated decode() has the signature of _decode_tree(); the last
+        bits of the stream and any tree path longer than the window are
+        handed to decode_tree (the codec's _decode_tree) so malformed data
+        fails exactly like the tree walk does.
+        
+        Returns:
+            Source code defining decode()
+        """
+        lines = [
+            "def decode(data, bit, bit_length, out, pos, end):",
+            f"    limit = bit_length - {COMPILED_WINDOW_BITS}",
+            "    for pos in range(pos, end):",
+            "        if bit > limit:",
+            "            break",
+            "        i = 1 + (bit >> 3)",
+            "        w = (data[i] | (data[i + 1] << 8) | (data[i + 2] << 16)) >> (bit & 7)",
+            "        if not w & 1:",
+            "            # Raw 8-bit value after a 0 prefix bit",
+            "            out[pos] = (w >> 1) & 0xFF",
+            "            bit += 9",
+            "        else:",
+        ]
+        
+        left = self.left_child
+        right = self.right_child
+        
+        def store(val, bits, indent):
+            lines.append(f"{indent}out[pos] = {val & 0xFF}")
+            lines.append(f"{indent}bit += {bits}")
+        
+        def branch(n, depth, indent):
+            # Node n is reached after depth bits; window bit depth picks the child
+            if depth >= COMPILED_WINDOW_BITS:
+                lines.append(f"{indent}break")
+                return
+            for test, child in ((f"if w & {1 << depth}:", right[n]),
+                                ("else:", left[n])):
+                lines.append(indent + test)
+                if child == -1:
+                    store(n, depth, indent + "    ")
+                elif left[child] == -1 and right[child] == -1:
+                    store(child, depth + 1, indent + "    ")
+                else:
+                    branch(child, depth + 1, indent + "    ")
+        
+        branch(510, 1, " " * 12)
+        lines += [
+            "    else:",
+            "        return end, bit",
+            "    return decode_tree(data, bit, bit_length, out, pos, end)",
+        ]
+        return "\n".join(lines) + "\n"
+    
+    def _compiled_decoder(self):
+        """Return the "compiled" engine's decode function for this codec"""
+        # The source is generated and compiled once per frequency table
+        code = _DECODER_CODE_CACHE.get(self.freqs)
+        if code is None:
+            with _CACHE_LOCK:
+                code = _DECODER_CODE_CACHE.get(self.freqs)
+                if code is None:
+                    code = compile(self.decoder_source(), "<huffman_bs compiled decoder>", "exec")
+                    _DECODER_CODE_CACHE[self.freqs] = code
+        namespace = {"decode_tree": self._decode_tree}
+        exec(code, namespace)
+        return namespace["decode"]
     
     def write_bits(self, output, bit_pos, val, val_bits):
         """
@@ -342,14 +1007,16 @@ class HuffmanCodec:
         if len(data) == 0:
             return bytes()
         
-        # First byte must have high bit clear (used for compression flag)
-        if data[0] & 0x80:
-            raise ValueError("First byte must have high bit clear (required for compression flag)")
+        cache = self.compress_cache
+        if cache is not None:
+            result = cache.get(data)
+            if result is not None:
+                # Compressed results are always shorter, so an equal length
+                # result is the stored copy of an incompressible input
+                return data if len(result) == len(data) else result
         
-        # Calculate total bits needed
-        bit_count = 0
-        for byte in data:
-            bit_count += self.nodes[byte].bits
+        symbols = self._numpy_symbols(data)
+        bit_count = self._code_bit_count(data, symbols)
         
         # Calculate output size
         length_out = (bit_count + 7) // 8 + 1  # Round up + 1 byte header
@@ -357,36 +1024,232 @@ class HuffmanCodec:
         
         # If compression doesn't help, return original
         if length_out >= len(data):
+            if cache is not None:
+                cache.put(data, bytes(data))
             return data
         
-        # Build compressed output
-        output = [0]  # Header byte
-        bit_pos = 8   # Start after header
-        
-        for byte in data:
-            bit_pos = self.write_bits(output, bit_pos, 
-                                     self.nodes[byte].val, 
-                                     self.nodes[byte].bits)
+        # Build compressed output after the header byte
+        output = bytearray(length_out)
+        if symbols is not None:
+            self._write_codes_numpy(symbols, output, 1)
+        else:
+            self._write_codes(data, output, 1)
         
         # Set header: low 4 bits = unused trailing bits, high bit = compressed flag
         output[0] = (8 - remainder % 8) if remainder else 0
         output[0] |= 0x80  # Mark as compressed
         
-        return bytes(output)
+        result = bytes(output)
+        if cache is not None:
+            cache.put(data, result)
+        return result
+    
+    def _numpy_symbols(self, data):
+        """
+        Return data as a NumPy uint8 array if the NumPy encoder takes it.
+        
+        Only byte buffers of at least numpy_min_length bytes qualify; other
+        inputs (e.g. lists of ints) and every input when NumPy isn't
+        installed are left to the pure-Python encoder (returns None).
+        """
+        if len(data) < self.numpy_min_length:
+            return None
+        try:
+            view = memoryview(data)
+        except TypeError:
+            return None
+        if view.format != "B" or view.ndim != 1:
+            return None
+        if _numpy() is None:
+            self.numpy_min_length = float("inf")
+            return None
+        return np.frombuffer(view, dtype=np.uint8)
+    
+    def _numpy_codes(self):
+        """Return the shared read-only NumPy (code_bits, code_vals) arrays."""
+        tables = _NUMPY_TABLE_CACHE.get(self.freqs)
+        if tables is None:
+            with _CACHE_LOCK:
+                tables = _NUMPY_TABLE_CACHE.get(self.freqs)
+                if tables is None:
+                    tables = (
+                        np.array(self.code_bits, dtype=np.int64),
+                        np.array(self.code_vals, dtype=np.int64),
+                    )
+                    for table in tables:
+                        table.flags.writeable = False
+                    _NUMPY_TABLE_CACHE[self.freqs] = tables
+        return tables
+    
+    def _code_bit_count(self, data, symbols=None):
+        """
+        Validate data for compression and count the bits its codes take.
+        
+        Args:
+            data: Raw bytes to compress
+            symbols: data as returned by _numpy_symbols(), None to count in Python
+            
+        Raises:
+            ValueError: If first byte has high bit set (reserved for compression flag)
+        """
+        # First byte must have high bit clear (used for compression flag)
+        if data[0] & 0x80:
+            raise ValueError("First byte must have high bit clear (required for compression flag)")
+        
+        # Calculate total bits needed
+        if symbols is not None:
+            return int(self._numpy_codes()[0][symbols].sum())
+        return sum(map(self.code_bits.__getitem__, data))
+    
+    def _write_codes(self, data, output, pos):
+        """
+        Write the codes for every byte of data into a preallocated buffer.
+        
+        Codes are collected LSB first in an integer bit accumulator and
+        flushed 16 bits at a time, producing the same bitstream as calling
+        write_bits() per byte. The loop is huffman_bs_min.K(), shared with
+        the minimal module.
+        
+        Args:
+            data: Raw bytes to encode
+            output: Writable buffer large enough for the codes
+            pos: Byte index in output to start writing at
+            
+        Returns:
+            Byte index in output after the last (partial) byte written
+        """
+        return huffman_bs_min.K(data, output, pos, self.code_bits, self.code_vals)
     
-    def decompress(self, data):
+    def decompress(self, data, max_output=None, max_bits=None):
         """
         Decompress Huffman-encoded data.
         
+        With a limit given, the header is validated strictly before any
+        decode work (see _check_limits()) and decoding stops as soon as
+        max_output bytes have been produced, so a hostile packet costs at
+        most max_output symbols of work.
+        
+        Without limits the header is read like the game's decoder reads it:
+        the reserved bits 4-6 are ignored and an unused trailing bit count
+        of 8 or more only shortens the payload, so every packet the game
+        accepts decodes here too. Pass a limit to reject such headers.
+        
         Args:
             data: Compressed bytes
+            max_output: Largest decompressed size accepted (None = no limit)
+            max_bits: Most compressed payload bits accepted (None = no limit)
             
         Returns:
             Decompressed bytes
             
         Raises:
+            DecompressionLimitError: If a limit is exceeded
             ValueError: If data is malformed
         """
+        bit_length = self._payload_bits(data)
+        end = (bit_length >> 1) + 1
+        if max_output is not None or max_bits is not None:
+            self._check_limits(data, bit_length, max_output, max_bits)
+            if max_output is not None and max_output < end:
+                end = max_output
+        
+        if bit_length < 0:
+            # Not compressed, return as-is
+            return data
+        
+        cache = self.decompress_cache
+        if cache is not None:
+            result = cache.get(data)
+            if result is not None:
+                if len(result) > end:
+                    raise DecompressionLimitError(
+                        f"Decompressed size exceeds max_output ({max_output} bytes)"
+                    )
+                return result
+        
+        # Every symbol takes at least 2 bits, so this always fits the output
+        # unless max_output is smaller
+        out = bytearray(end)
+        pos, bit = self._decode(data, 0, bit_length, out, 0, end)
+        if bit < bit_length:
+            raise DecompressionLimitError(
+                f"Decompressed size exceeds max_output ({max_output} bytes)"
+            )
+        result = bytes(out[:pos])
+        if cache is not None:
+            cache.put(data, result)
+        return result
+    
+    def peek(self, data, n):
+        """
+        Decompress only the first n bytes of data.
+        
+        Decoding stops after n output bytes, so classifying a packet by its
+        scene packet and message type costs a few symbols instead of the
+        whole payload. Errors in the skipped part are not detected.
+        
+        Args:
+            data: Compressed bytes
+            n: Number of output bytes wanted
+            
+        Returns:
+            PeekResult(compressed, remainder, data): the header's compressed
+            flag and unused trailing bit count (None if not compressed), and
+            up to n decompressed bytes
+            
+        Raises:
+            ValueError: If data is malformed within the first n bytes
+        """
+        bit_length = self._payload_bits(data)
+        if bit_length < 0:
+            return PeekResult(False, None, bytes(data[:n]))
+        
+        out = bytearray(min(n, (bit_length >> 1) + 1))
+        pos, _ = self._decode(data, 0, bit_length, out, 0, len(out))
+        return PeekResult(True, data[0] & 0x0F, bytes(out[:pos]))
+    
+    def _write_codes_numpy(self, symbols, output, pos):
+        """
+        Vectorized version of _write_codes() using NumPy.
+        
+        Gathers each byte's code length and value, places the codes with a
+        cumulative sum of the lengths and shifts each code to its bit offset
+        within its first output byte. A code then covers at most two bytes;
+        since codes never overlap, summing the byte parts with bincount is
+        the same as OR-ing them together.
+        
+        Args:
+            symbols: Raw bytes to encode, as returned by _numpy_symbols()
+            output, pos: same as _write_codes()
+            
+        Returns: same as _write_codes()
+        """
+        code_bits, code_vals = self._numpy_codes()
+        lengths = code_bits[symbols]
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        byte_count = (int(ends[-1]) + 7) >> 3
+        
+        words = code_vals[symbols] << (starts & 7)
+        index = starts >> 3
+        packed = (
+            np.bincount(index, weights=words & 0xFF, minlength=byte_count + 1)
+            + np.bincount(index + 1, weights=words >> 8, minlength=byte_count + 1)
+        )
+        
+        output[pos:pos + byte_count] = packed[:byte_count].astype(np.uint8).tobytes()
+        return pos + byte_count
+    
+    def _payload_bits(self, data):
+        """
+        Read the header byte of compressed data.
+        
+        Returns:
+            Number of valid payload bits, or -1 if data is not compressed
+            
+        Raises:
+            ValueError: If data is empty or the header is invalid
+        """
         if len(data) == 0:
             raise ValueError("Empty data")
         
@@ -395,97 +1258,857 @@ class HuffmanCodec:
         compressed = (data[0] >> 7) & 1
         
         if not compressed:
-            # Not compressed, return as-is
-            return data
+            return -1
         
         # Calculate bit length
         bit_length = (len(data) - 1) * 8
         if remainder > bit_length:
             raise ValueError("Invalid huffman data: remainder > bit_length")
-        bit_length -= remainder
-        
-        out = []
-        bit = 0
-        ptr_offset = 1  # Skip header byte
-        
-        # Decode bit by bit
-        while bit < bit_length:
-            # Read prefix bit
-            bitval = (data[ptr_offset + bit // 8] >> (bit % 8)) & 1
-            bit += 1
-            
-            if bitval:
-                # Huffman-encoded value: walk tree
-                n = 510  # Start at root
-                while True:
-                    bitval = (data[ptr_offset + bit // 8] >> (bit % 8)) & 1
-                    
-                    # Navigate tree: 0 = left, 1 = right
-                    if bitval == 0:
-                        if self.nodes[n].left_child == -1:
-                            val = n
-                            break
-                        else:
-                            n = self.nodes[n].left_child
-                            bit += 1
-                    else:
-                        if self.nodes[n].right_child == -1:
-                            val = n
-                            break
-                        else:
-                            n = self.nodes[n].right_child
-                            bit += 1
-                    
-                    # Detect dead-end nodes
-                    if self.nodes[n].left_child == -1 and self.nodes[n].right_child == -1:
-                        val = n
-                        break
-                    
-                    if bit > bit_length:
-                        raise ValueError("Bit position exceeded bit_length during huffman decode")
-                
-                out.append(val & 0xFF)
-            else:
-                # Raw 8-bit value
-                if bit % 8 == 0:
-                    val = data[ptr_offset + bit // 8]
-                else:
-                    val = (data[ptr_offset + bit // 8] >> (bit % 8)) | \
-                          (data[ptr_offset + bit // 8 + 1] << (8 - bit % 8))
-                out.append(val & 0xFF)
-                bit += 8
-                
-                if bit > bit_length:
-                    raise ValueError("Bit position exceeded bit_length during raw read")
-        
-        return bytes(out)
+        return bit_length - remainder
     
-    def encode_full_packet(self, scene_packet_data, client_id=0x7c):
+    def _check_limits(self, data, bit_length, max_output, max_bits):
         """
-        Encode a complete network packet with header and compression.
+        Reject data that cannot be decoded within the limits, from the header
+        alone.
         
-        Creates a full UDP packet ready to send, consisting of:
-        [packet_type] [client_id] [compressed_scene_packet_data]
+        Besides the limits, this checks the header fields the encoder never
+        sets: the reserved bits 4-6, and an unused trailing bit count of 8 or
+        more (a whole unused payload byte). It only runs when a limit is
+        given; decoding without limits accepts those headers, like the game
+        does (see decompress()).
         
         Args:
-            scene_packet_data: Raw scene packet bytes to encode
-            client_id: Client ID byte (default 0x7c = 124)
+            data: Packet passed to a decompress method
+            bit_length: Its _payload_bits() result
+            max_output: Largest decompressed size accepted, or None
+            max_bits: Most compressed payload bits accepted, or None
             
-        Returns:
-            Complete packet bytes ready to send
+        Raises:
+            DecompressionLimitError: If a limit is certainly exceeded
+            ValueError: If the header is invalid
         """
-        # Compress the scene packet
-        compressed = self.compress(scene_packet_data)
+        if bit_length < 0:
+            # Not compressed, the output is the input
+            if max_output is not None and len(data) > max_output:
+                raise DecompressionLimitError(
+                    f"Decompressed size exceeds max_output ({max_output} bytes)"
+                )
+            return
         
-        # Add packet header
-        full_packet = bytes([BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED, client_id]) + compressed
-        return full_packet
-
-
-# ============================================================================
-# UTILITY FUNCTIONS
-# ============================================================================
-
+        if data[0] & 0x70:
+            raise ValueError("Invalid huffman data: reserved header bits set")
+        if data[0] & 0x0F > 7:
+            raise ValueError("Invalid huffman data: remainder >= 8")
+        if max_bits is not None and bit_length > max_bits:
+            raise DecompressionLimitError(
+                f"Compressed payload exceeds max_bits ({bit_length} > {max_bits})"
+            )
+        # Every symbol takes at most 9 bits
+        if max_output is not None and bit_length // 9 > max_output:
+            raise DecompressionLimitError(
+                f"Decompressed size exceeds max_output ({max_output} bytes)"
+            )
+    
+    def _decode_tree(self, data, bit, bit_length, out, pos, end):
+        """
+        Decode symbols bit by bit by walking the Huffman tree (the loop is
+        huffman_bs_min.W(), shared with the minimal module).
+        
+        Args:
+            data: Compressed bytes (including header byte)
+            bit: Payload bit position to start decoding at
+            bit_length: Number of valid payload bits
+            out: Writable buffer to store decoded bytes in
+            pos: Index in out to store the next decoded byte at
+            end: Stop once out[end - 1] has been stored
+            
+        Returns:
+            Tuple of (index in out after the last decoded byte, bit position
+            after the last decoded symbol)
+        """
+        return huffman_bs_min.W(data, bit, bit_length, out, pos, end,
+                                self.left_child, self.right_child)
+    
+    def _decode_table(self, data, bit, bit_length, out, pos, end):
+        """
+        Decode symbols using the multi-bit lookup table.
+        
+        Resolves one whole symbol (prefix bit + huffman code, or prefix bit +
+        raw 8-bit value) per table lookup while a full window of valid bits is
+        left. The last few bits (and any symbol not resolvable within the
+        window) are handed to _decode_tree() so malformed data fails exactly
+        like the tree walk does. The loop is huffman_bs_min.D(), shared with
+        the minimal module.
+        
+        Args/Returns: same as _decode_tree()
+        """
+        return huffman_bs_min.D(data, bit, bit_length, out, pos, end, self.decode_table,
+                                self.left_child, self.right_child)
+    
+    def compress_many(self, packets, offsets=None):
+        """
+        Compress many packets into one contiguous buffer.
+        
+        Gives the same results as calling compress() on every packet, without
+        allocating a bytes object per packet.
+        
+        Args:
+            packets: List of packets, or one contiguous buffer if offsets is given
+            offsets: Packet boundaries in packets (packet i is
+                packets[offsets[i]:offsets[i + 1]]), or None
+            
+        Returns:
+            Tuple of (output, out_offsets): a bytearray holding every result
+            back to back, and the boundaries of each result in it
+            
+        Raises:
+            ValueError: If a packet's first byte has high bit set
+        """
+        output = bytearray()
+        out_offsets = [0]
+        pos = 0
+        
+        for data in _iter_packets(packets, offsets):
+            # Results are never longer than the input
+            _reserve(output, pos, len(data))
+            pos = self._compress_to(data, output, pos, len(output))
+            out_offsets.append(pos)
+        
+        del output[pos:]
+        return output, out_offsets
+    
+    def decompress_many(self, packets, offsets=None, max_output=None, max_bits=None):
+        """
+        Decompress many packets into one contiguous buffer.
+        
+        Gives the same results as calling decompress() on every packet,
+        without allocating a bytes object per packet.
+        
+        Args:
+            packets: List of packets, or one contiguous buffer if offsets is given
+            offsets: Packet boundaries in packets (packet i is
+                packets[offsets[i]:offsets[i + 1]]), or None
+            max_output: Largest decompressed size accepted per packet
+            max_bits: Most compressed payload bits accepted per packet
+            
+        Returns:
+            Tuple of (output, out_offsets): a bytearray holding every result
+            back to back, and the boundaries of each result in it
+            
+        Raises:
+            DecompressionLimitError: If a packet exceeds a limit
+            ValueError: If a packet is malformed
+        """
+        output = bytearray()
+        out_offsets = [0]
+        pos = 0
+        
+        for data in _iter_packets(packets, offsets):
+            # Every symbol takes at least 2 of the 8 bits per input byte
+            _reserve(output, pos, 4 * len(data))
+            pos = self._decompress_to(data, output, pos, len(output), max_output, max_bits)
+            out_offsets.append(pos)
+        
+        del output[pos:]
+        return output, out_offsets
+    
+    def compress_into(self, data, out, offset=0):
+        """
+        Compress data straight into a caller-owned buffer.
+        
+        Writes the same bytes compress() would return, without allocating
+        any intermediate buffers.
+        
+        Args:
+            data: Raw bytes to compress (bytes, bytearray or memoryview)
+            out: Writable buffer to store the result in
+            offset: Index in out to store the result at
+            
+        Returns:
+            Number of bytes written
+            
+        Raises:
+            ValueError: If first byte has high bit set, or out is too small
+        """
+        view = _byte_view(out)
+        return self._compress_to(data, view, offset, len(view)) - offset
+    
+    def decompress_into(self, data, out, offset=0, max_output=None, max_bits=None):
+        """
+        Decompress data straight into a caller-owned buffer.
+        
+        Writes the same bytes decompress() would return.
+        
+        Args:
+            data: Compressed bytes (bytes, bytearray or memoryview)
+            out: Writable buffer to store the result in
+            offset: Index in out to store the result at
+            max_output: Largest decompressed size accepted (None = no limit)
+            max_bits: Most compressed payload bits accepted (None = no limit)
+            
+        Returns:
+            Number of bytes written
+            
+        Raises:
+            DecompressionLimitError: If a limit is exceeded
+            ValueError: If data is malformed, or out is too small
+        """
+        view = _byte_view(out)
+        return self._decompress_to(data, view, offset, len(view), max_output, max_bits) - offset
+    
+    def encode_full_packet_into(self, scene_packet_data, out, offset=0, client_id=0x7c,
+                                packet_type=BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED):
+        """
+        Encode a complete network packet straight into a caller-owned buffer.
+        
+        Writes the same bytes encode_full_packet() would return:
+        [packet_type] [client_id] [compressed_scene_packet_data]
+        
+        Args:
+            scene_packet_data: Raw scene packet bytes to encode
+            out: Writable buffer to store the packet in
+            offset: Index in out to store the packet at
+            client_id: Client ID byte (default 0x7c = 124)
+            packet_type: BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED (default) or
+                BA_PACKET_HOST_GAMEPACKET_COMPRESSED for host-to-client packets
+            
+        Returns:
+            Number of bytes written
+            
+        Raises:
+            ValueError: If out is too small
+        """
+        view = _byte_view(out)
+        if offset + 2 > len(view):
+            raise ValueError("Output buffer too small for packet header")
+        view[offset] = packet_type
+        view[offset + 1] = client_id
+        # Through compress_into(), so enable_stats() counts the call
+        return self.compress_into(scene_packet_data, view, offset + 2) + 2
+    
+    def _compress_to(self, data, output, pos, end):
+        """
+        Write the compress() result for data into output[pos:end].
+        
+        Returns:
+            Index in output after the written bytes
+            
+        Raises:
+            ValueError: If first byte has high bit set, or the result doesn't fit
+        """
+        if len(data) == 0:
+            return pos
+        
+        symbols = self._numpy_symbols(data)
+        bit_count = self._code_bit_count(data, symbols)
+        length_out = (bit_count + 7) // 8 + 1
+        remainder = bit_count % 8
+        
+        if length_out >= len(data):
+            # Compression doesn't help, copy original
+            if pos + len(data) > end:
+                raise ValueError("Output buffer too small")
+            output[pos:pos + len(data)] = data
+            return pos + len(data)
+        
+        if pos + length_out > end:
+            raise ValueError("Output buffer too small")
+        if symbols is not None:
+            self._write_codes_numpy(symbols, output, pos + 1)
+        else:
+            self._write_codes(data, output, pos + 1)
+        output[pos] = ((8 - remainder % 8) if remainder else 0) | 0x80
+        return pos + length_out
+    
+    def _decompress_to(self, data, output, pos, end, max_output=None, max_bits=None):
+        """
+        Write the decompress() result for data into output[pos:end].
+        
+        Returns:
+            Index in output after the written bytes
+            
+        Raises:
+            DecompressionLimitError: If a limit is exceeded
+            ValueError: If data is malformed, or the result doesn't fit
+        """
+        bit_length = self._payload_bits(data)
+        limited = False
+        if max_output is not None or max_bits is not None:
+            self._check_limits(data, bit_length, max_output, max_bits)
+            if max_output is not None and pos + max_output < end:
+                end = pos + max_output
+                limited = True
+        
+        if bit_length < 0:
+            # Not compressed, copy as-is
+            if pos + len(data) > end:
+                raise ValueError("Output buffer too small")
+            output[pos:pos + len(data)] = data
+            return pos + len(data)
+        
+        pos, bit = self._decode(data, 0, bit_length, output, pos, end)
+        if bit < bit_length:
+            if limited:
+                raise DecompressionLimitError(
+                    f"Decompressed size exceeds max_output ({max_output} bytes)"
+                )
+            raise ValueError("Output buffer too small")
+        return pos
+    
+    def encode_full_packet(self, scene_packet_data, client_id=0x7c,
+                           packet_type=BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED):
+        """
+        Encode a complete network packet with header and compression.
+        
+        Creates a full UDP packet ready to send, consisting of:
+        [packet_type] [client_id] [compressed_scene_packet_data]
+        
+        Args:
+            scene_packet_data: Raw scene packet bytes to encode
+            client_id: Client ID byte (default 0x7c = 124)
+            packet_type: BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED (default) or
+                BA_PACKET_HOST_GAMEPACKET_COMPRESSED for host-to-client packets
+            
+        Returns:
+            Complete packet bytes ready to send
+        """
+        # Compress the scene packet
+        compressed = self.compress(scene_packet_data)
+        
+        # Add packet header
+        full_packet = bytes([packet_type, client_id]) + compressed
+        return full_packet
+    
+    def enable_stats(self, stats=None):
+        """
+        Start collecting CodecStats for this codec.
+        
+        compress(), decompress(), compress_into() and decompress_into() are
+        replaced by counting wrappers on this instance only, so codecs without
+        stats run the plain methods and pay nothing. encode_full_packet() and
+        encode_full_packet_into() go through them and are counted too; the
+        batch methods (compress_many(), decompress_many()) are not counted.
+        
+        Args:
+            stats: CodecStats to add to (e.g. shared by several codecs), or
+                None for a fresh one
+        
+        Returns:
+            The CodecStats being collected into (also self.stats)
+        """
+        self.stats = CodecStats() if stats is None else stats
+        # Bytes the encoder emits as a 0 prefix bit + raw 8-bit value
+        self._raw_symbols = bytes(bits > 8 for bits in self.code_bits)
+        self.compress = self._compress_counted
+        self.decompress = self._decompress_counted
+        self.compress_into = self._compress_into_counted
+        self.decompress_into = self._decompress_into_counted
+        return self.stats
+    
+    def disable_stats(self):
+        """
+        Stop collecting stats and restore the plain methods.
+        
+        Returns:
+            The CodecStats that was being collected into, or None
+        """
+        stats = self.stats
+        for name in ("stats", "_raw_symbols", "compress", "decompress",
+                     "compress_into", "decompress_into"):
+            self.__dict__.pop(name, None)
+        return stats
+    
+    def enable_cache(self, max_entries=1024, max_bytes=1 << 20, max_key_length=128):
+        """
+        Memoize compress() and decompress() results for repeated packets.
+        
+        Each direction gets its own PacketCache keyed on the input bytes.
+        Only compress() and decompress() use the caches; failed calls are
+        not cached.
+        
+        Args:
+            max_entries: Most packets kept per cache
+            max_bytes: Most key plus value bytes kept per cache
+            max_key_length: Longest input looked up or stored; longer
+                packets bypass the cache
+        
+        Returns:
+            Tuple of (compress_cache, decompress_cache)
+        """
+        self.compress_cache = PacketCache(max_entries, max_bytes, max_key_length)
+        self.decompress_cache = PacketCache(max_entries, max_bytes, max_key_length)
+        return self.compress_cache, self.decompress_cache
+    
+    def disable_cache(self):
+        """Stop caching and drop the caches"""
+        self.__dict__.pop("compress_cache", None)
+        self.__dict__.pop("decompress_cache", None)
+    
+    def _count_raw_symbols(self, data):
+        return sum(map(self._raw_symbols.__getitem__, data))
+    
+    def _compress_counted(self, data):
+        start = time.perf_counter_ns()
+        try:
+            result = HuffmanCodec.compress(self, data)
+        except Exception as e:
+            self.stats.record_error("compress", e, time.perf_counter_ns() - start)
+            raise
+        elapsed = time.perf_counter_ns() - start
+        uncompressed = result is data
+        raw = 0 if uncompressed else self._count_raw_symbols(data)
+        self.stats.record("compress", len(data), len(result), uncompressed,
+                          raw, len(data), elapsed)
+        return result
+    
+    def _decompress_counted(self, data, max_output=None, max_bits=None):
+        start = time.perf_counter_ns()
+        try:
+            result = HuffmanCodec.decompress(self, data, max_output, max_bits)
+        except Exception as e:
+            self.stats.record_error("decompress", e, time.perf_counter_ns() - start)
+            raise
+        elapsed = time.perf_counter_ns() - start
+        uncompressed = result is data
+        raw = 0 if uncompressed else self._count_raw_symbols(result)
+        self.stats.record("decompress", len(data), len(result), uncompressed,
+                          raw, len(result), elapsed)
+        return result
+    
+    def _compress_into_counted(self, data, out, offset=0):
+        start = time.perf_counter_ns()
+        try:
+            size = HuffmanCodec.compress_into(self, data, out, offset)
+        except Exception as e:
+            self.stats.record_error("compress", e, time.perf_counter_ns() - start)
+            raise
+        elapsed = time.perf_counter_ns() - start
+        # Compressed results are always shorter than the input
+        uncompressed = size == len(data)
+        raw = 0 if uncompressed else self._count_raw_symbols(data)
+        self.stats.record("compress", len(data), size, uncompressed,
+                          raw, len(data), elapsed)
+        return size
+    
+    def _decompress_into_counted(self, data, out, offset=0, max_output=None, max_bits=None):
+        start = time.perf_counter_ns()
+        try:
+            size = HuffmanCodec.decompress_into(self, data, out, offset, max_output, max_bits)
+        except Exception as e:
+            self.stats.record_error("decompress", e, time.perf_counter_ns() - start)
+            raise
+        elapsed = time.perf_counter_ns() - start
+        uncompressed = not data[0] & 0x80
+        raw = 0
+        if not uncompressed:
+            raw = self._count_raw_symbols(_byte_view(out)[offset:offset + size])
+        self.stats.record("decompress", len(data), size, uncompressed,
+                          raw, size, elapsed)
+        return size
+
+
+# ============================================================================
+# SCENE PACKET PARSING
+# ============================================================================
+
+class MessageView:
+    """
+    Lazy view over one message inside a scene packet.
+    
+    Fields are read from the underlying buffer on access; nothing is copied
+    until tobytes() is called.
+    """
+    __slots__ = ("_buf",)
+    
+    def __init__(self, data):
+        self._buf = data if isinstance(data, memoryview) else memoryview(data)
+    
+    def __len__(self):
+        return len(self._buf)
+    
+    def __repr__(self):
+        return f"<MessageView {self.type_name} ({len(self._buf)} bytes)>"
+    
+    @property
+    def message_type(self):
+        """BA_MESSAGE_* type (first byte)"""
+        return self._buf[0]
+    
+    @property
+    def type_name(self):
+        """Name of the message type, or 'UNKNOWN'"""
+        return MESSAGE_TYPES.get(self._buf[0], "UNKNOWN")
+    
+    @property
+    def payload(self):
+        """Message data after the type byte (memoryview)"""
+        return self._buf[1:]
+    
+    @property
+    def raw(self):
+        """Whole message including the type byte (memoryview)"""
+        return self._buf
+    
+    def tobytes(self):
+        """Copy the whole message into a bytes object"""
+        return self._buf.tobytes()
+
+
+class ScenePacketView:
+    """
+    Lazy view over a decompressed scene packet.
+    
+    Only the bytes a field needs are read when it is accessed, so e.g.
+    filtering on message_type touches two bytes per packet and never
+    copies the payload.
+    
+    Usage:
+        packet = ScenePacketView(codec.decompress(data[2:]))
+        if packet.message_type == BA_MESSAGE_CHAT:
+            handle_chat(packet.message.payload)
+    """
+    __slots__ = ("_buf",)
+    
+    def __init__(self, data):
+        self._buf = data if isinstance(data, memoryview) else memoryview(data)
+    
+    def __len__(self):
+        return len(self._buf)
+    
+    def __repr__(self):
+        return f"<ScenePacketView {self.type_name} ({len(self._buf)} bytes)>"
+    
+    @property
+    def packet_type(self):
+        """BA_SCENEPACKET_* type (first byte)"""
+        return self._buf[0]
+    
+    @property
+    def type_name(self):
+        """Name of the scene packet type, or 'UNKNOWN'"""
+        return SCENEPACKET_TYPES.get(self._buf[0], "UNKNOWN")
+    
+    @property
+    def is_message(self):
+        """True if the packet carries a complete message header"""
+        offset = MESSAGE_TYPE_OFFSETS.get(self._buf[0])
+        return offset is not None and len(self._buf) > offset
+    
+    @property
+    def header(self):
+        """Bytes between the packet type and the message (memoryview)"""
+        offset = MESSAGE_TYPE_OFFSETS.get(self._buf[0], 1)
+        return self._buf[1:offset]
+    
+    @property
+    def message_type(self):
+        """BA_MESSAGE_* type of the carried message, or None"""
+        offset = MESSAGE_TYPE_OFFSETS.get(self._buf[0])
+        if offset is None or len(self._buf) <= offset:
+            return None
+        return self._buf[offset]
+    
+    @property
+    def message(self):
+        """MessageView of the carried message, or None"""
+        offset = MESSAGE_TYPE_OFFSETS.get(self._buf[0])
+        if offset is None or len(self._buf) <= offset:
+            return None
+        return MessageView(self._buf[offset:])
+    
+    @property
+    def raw(self):
+        """Whole scene packet (memoryview)"""
+        return self._buf
+
+
+def iter_messages(scene_packets, message_types=None):
+    """
+    Yield the messages of scene packets, optionally filtered by type.
+    
+    Args:
+        scene_packets: Iterable of decompressed scene packets (None entries,
+            as yielded for undecodable packets, are skipped)
+        message_types: BA_MESSAGE_* types to keep, or None for all
+        
+    Yields:
+        MessageView objects over the original buffers
+    """
+    for data in scene_packets:
+        if not data:
+            continue
+        packet = ScenePacketView(data)
+        message_type = packet.message_type
+        if message_type is None:
+            continue
+        if message_types is None or message_type in message_types:
+            yield packet.message
+
+
+class MultipartError(ValueError):
+    """Multipart message violates the protocol or a reassembly limit"""
+
+
+# Default limits of MultipartReassembler
+MULTIPART_MAX_BYTES = 1024 * 1024
+MULTIPART_MAX_FRAGMENTS = 1024
+
+
+class MultipartReassembler:
+    """
+    Incremental reassembler for BA_MESSAGE_MULTIPART messages.
+    
+    Large messages are split into BA_MESSAGE_MULTIPART fragments followed by
+    a BA_MESSAGE_MULTIPART_END fragment; the fragment payloads (without the
+    type bytes) joined together form the original message. Keep one
+    reassembler per connection and feed it that connection's decompressed
+    scene packets in arrival order.
+    
+    Fragments are appended to one growable buffer, which is handed out as
+    the finished message, so reassembly is linear in the message size.
+    
+    Usage:
+        reassembler = MultipartReassembler()
+        for scene_packet in packets:
+            message = reassembler.feed(scene_packet)
+            if message is not None:
+                handle(message.message_type, message.payload)
+    """
+    
+    def __init__(self, max_bytes=MULTIPART_MAX_BYTES, max_fragments=MULTIPART_MAX_FRAGMENTS):
+        """
+        Args:
+            max_bytes: Largest reassembled message allowed
+            max_fragments: Most fragments one message may consist of
+        """
+        self.max_bytes = max_bytes
+        self.max_fragments = max_fragments
+        self.stats = collections.Counter()
+        self._buffer = bytearray()
+        self._fragments = 0
+    
+    @property
+    def pending_bytes(self):
+        """Bytes of the message currently being reassembled"""
+        return len(self._buffer)
+    
+    @property
+    def pending_fragments(self):
+        """Fragments of the message currently being reassembled"""
+        return self._fragments
+    
+    def reset(self):
+        """Drop any partially reassembled message"""
+        self._buffer = bytearray()
+        self._fragments = 0
+    
+    def feed(self, scene_packet):
+        """
+        Process one decompressed scene packet.
+        
+        Args:
+            scene_packet: Decompressed scene packet (bytes, memoryview or
+                ScenePacketView)
+            
+        Returns:
+            MessageView of a complete message (a plain message, or the
+            reassembled one on BA_MESSAGE_MULTIPART_END), or None
+            
+        Raises:
+            MultipartError: If a limit is exceeded or MULTIPART_END arrives
+                without fragments; the partial message is dropped
+        """
+        if not isinstance(scene_packet, ScenePacketView):
+            scene_packet = ScenePacketView(scene_packet)
+        message = scene_packet.message
+        if message is None:
+            return None
+        
+        message_type = message.message_type
+        if message_type != BA_MESSAGE_MULTIPART and message_type != BA_MESSAGE_MULTIPART_END:
+            self.stats["messages"] += 1
+            return message
+        
+        if message_type == BA_MESSAGE_MULTIPART_END and not self._fragments:
+            self.stats["errors"] += 1
+            raise MultipartError("BA_MESSAGE_MULTIPART_END without preceding fragments")
+        
+        payload = message.payload
+        if len(self._buffer) + len(payload) > self.max_bytes:
+            self._fail()
+            raise MultipartError(f"Multipart message exceeds {self.max_bytes} bytes")
+        if self._fragments + 1 > self.max_fragments:
+            self._fail()
+            raise MultipartError(f"Multipart message exceeds {self.max_fragments} fragments")
+        
+        self._buffer += payload
+        self._fragments += 1
+        if message_type == BA_MESSAGE_MULTIPART:
+            return None
+        
+        # Hand the buffer out as the message and start a fresh one
+        complete = self._buffer
+        self.reset()
+        self.stats["messages"] += 1
+        self.stats["multipart_messages"] += 1
+        return MessageView(complete)
+    
+    def _fail(self):
+        self.stats["errors"] += 1
+        self.stats["dropped_bytes"] += len(self._buffer)
+        self.reset()
+
+
+# ============================================================================
+# MESSAGE PACKING
+# ============================================================================
+
+# Default datagram size budget of MessagePacker (bytes, including the
+# packet type and client ID bytes)
+PACKER_MTU = 1400
+
+
+class MessagePacker:
+    """
+    Packs consecutive messages into as few compressed game packets as fit
+    a datagram size budget.
+    
+    Appended messages are concatenated into one scene packet (starting with
+    header, if given). The compressed size of that scene packet is tracked
+    exactly from the codec's per-byte code lengths as messages arrive, so
+    no trial compression is needed: the datagram is 2 header bytes plus
+    the Huffman payload, or the raw scene packet if compressing doesn't
+    make it shorter (the same rule as HuffmanCodec.compress()). When the
+    next message would push the datagram past mtu, the pending scene
+    packet is flushed as an encode_full_packet() datagram first.
+    
+    Usage:
+        packer = MessagePacker(mtu=1200, header=scene_header)
+        for message in messages:
+            datagram = packer.add(message)
+            if datagram is not None:
+                sock.sendto(datagram, addr)
+        datagram = packer.flush()
+        if datagram is not None:
+            sock.sendto(datagram, addr)
+    """
+    
+    def __init__(self, codec=None, mtu=PACKER_MTU, header=b"", client_id=0x7c,
+                 packet_type=BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED):
+        """
+        Args:
+            codec: HuffmanCodec to encode with (default: a new one)
+            mtu: Largest datagram to produce, in bytes
+            header: Bytes starting every scene packet (e.g. the scene packet
+                type and fields before the messages)
+            client_id: Client ID byte of every datagram
+            packet_type: BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED (default) or
+                BA_PACKET_HOST_GAMEPACKET_COMPRESSED
+            
+        Raises:
+            ValueError: If header's first byte has high bit set
+        """
+        self.codec = codec if codec is not None else HuffmanCodec()
+        self.mtu = mtu
+        self.header = bytes(header)
+        self.client_id = client_id
+        self.packet_type = packet_type
+        if self.header and self.header[0] & 0x80:
+            raise ValueError("First byte must have high bit clear (required for compression flag)")
+        self._header_bits = sum(map(self.codec.code_bits.__getitem__, self.header))
+        self.stats = collections.Counter()
+        self.reset()
+    
+    def __len__(self):
+        """Number of messages waiting to be flushed"""
+        return self._messages
+    
+    @property
+    def size(self):
+        """Size of the datagram flush() would return now"""
+        return self._datagram_size(len(self._buffer), self._bits)
+    
+    def reset(self):
+        """Drop the pending messages"""
+        self._buffer = bytearray(self.header)
+        self._bits = self._header_bits
+        self._messages = 0
+    
+    def add(self, message):
+        """
+        Append one message.
+        
+        Args:
+            message: Message bytes
+            
+        Returns:
+            The datagram of the previously pending messages if message did
+            not fit next to them, else None
+            
+        Raises:
+            ValueError: If message can't fit a datagram even on its own, or
+                would start the scene packet with its high bit set; nothing
+                is flushed in that case
+        """
+        bits = sum(map(self.codec.code_bits.__getitem__, message))
+        length = len(self._buffer) + len(message)
+        if self._datagram_size(length, self._bits + bits) <= self.mtu:
+            if not self._buffer:
+                self._check_first_byte(message)
+            self._buffer += message
+            self._bits += bits
+            self._messages += 1
+            return None
+        
+        # Doesn't fit next to the pending messages: start a new datagram
+        if self._datagram_size(len(self.header) + len(message), self._header_bits + bits) > self.mtu:
+            raise ValueError(f"Message does not fit in a {self.mtu} byte datagram")
+        if not self.header:
+            self._check_first_byte(message)
+        datagram = self.flush()
+        self._buffer += message
+        self._bits += bits
+        self._messages += 1
+        return datagram
+    
+    def flush(self):
+        """
+        Encode the pending messages.
+        
+        Returns:
+            encode_full_packet() datagram, or None if no messages are pending
+        """
+        if not self._messages:
+            return None
+        datagram = self.codec.encode_full_packet(
+            bytes(self._buffer), client_id=self.client_id, packet_type=self.packet_type
+        )
+        self.stats["datagrams"] += 1
+        self.stats["messages"] += self._messages
+        self.stats["bytes_in"] += len(self._buffer)
+        self.stats["bytes_out"] += len(datagram)
+        if len(datagram) == len(self._buffer) + 2:
+            self.stats["uncompressed"] += 1
+        self.reset()
+        return datagram
+    
+    @staticmethod
+    def _datagram_size(length, bits):
+        if length == 0:
+            return 2
+        # Compressed size (header byte + codes) unless that isn't shorter
+        return 2 + min((bits + 7) // 8 + 1, length)
+    
+    @staticmethod
+    def _check_first_byte(message):
+        if message and message[0] & 0x80:
+            raise ValueError("First byte must have high bit clear (required for compression flag)")
+
+
+# ============================================================================
+# UTILITY FUNCTIONS
+# ============================================================================
+
 def decode_packet(hex_string, verbose=True):
     """
     Decode and display a packet from hex string.
@@ -518,14 +2141,10 @@ def decode_packet(hex_string, verbose=True):
             print(f"Scene packet type: 0x{decompressed[0]:02x} ({SCENEPACKET_TYPES.get(decompressed[0], 'UNKNOWN')})")
             
             # Try to decode message type
-            if decompressed[0] == BA_SCENEPACKET_MESSAGE and len(decompressed) >= 7:
-                message_type = decompressed[6]
-                print(f"Message type: 0x{message_type:02x} ({MESSAGE_TYPES.get(message_type, 'UNKNOWN')})")
-                print(f"Message data: {decompressed[7:].hex(' ')}")
-            elif decompressed[0] == BA_SCENEPACKET_MESSAGE_UNRELIABLE and len(decompressed) >= 9:
-                message_type = decompressed[8]
-                print(f"Message type: 0x{message_type:02x} ({MESSAGE_TYPES.get(message_type, 'UNKNOWN')})")
-                print(f"Message data: {decompressed[9:].hex(' ')}")
+            message = ScenePacketView(decompressed).message
+            if message is not None:
+                print(f"Message type: 0x{message.message_type:02x} ({message.type_name})")
+                print(f"Message data: {message.payload.hex(' ')}")
         
         return decompressed
     except Exception as e:
@@ -560,11 +2179,354 @@ def encode_packet(scene_packet_hex, client_id=0x7c, verbose=True):
     return full_packet
 
 
+# ============================================================================
+# SYNTHETIC TRAFFIC
+# ============================================================================
+
+# Share of synthetic payload bytes drawn uniformly instead of from G_FREQS,
+# so the raw 8-bit escape path is exercised like in real captures
+SYNTHETIC_RAW_SHARE = 0.05
+
+# (scene packet type, weight, (min size, max size)) of synthetic scene packets
+SYNTHETIC_SCENE_PACKETS = (
+    (BA_SCENEPACKET_MESSAGE, 40, (8, 160)),
+    (BA_SCENEPACKET_MESSAGE_UNRELIABLE, 45, (10, 1200)),
+    (BA_SCENEPACKET_KEEPALIVE, 10, (3, 8)),
+    (BA_SCENEPACKET_HANDSHAKE, 2, (20, 60)),
+    (BA_SCENEPACKET_HANDSHAKE_RESPONSE, 2, (20, 60)),
+    (BA_SCENEPACKET_DISCONNECT, 1, (1, 4)),
+)
+
+# Message types carried by synthetic (un)reliable message packets
+SYNTHETIC_MESSAGE_TYPES = (
+    (BA_MESSAGE_SESSION_COMMANDS, 30),
+    (BA_MESSAGE_SESSION_DYNAMICS_CORRECTION, 15),
+    (BA_MESSAGE_REMOTE_PLAYER_INPUT_COMMANDS, 40),
+    (BA_MESSAGE_CHAT, 5),
+    (BA_MESSAGE_NULL, 10),
+)
+
+
+def generate_scene_packet(rng, scene_type=None, size=None, freqs=G_FREQS):
+    """
+    Generate a synthetic scene packet following a byte frequency table.
+    
+    Args:
+        rng: random.Random instance (for reproducible corpora)
+        scene_type: BA_SCENEPACKET_* type (default: picked by weight)
+        size: Packet length in bytes (default: picked from the type's range)
+        freqs: Byte frequency table the payload follows
+        
+    Returns:
+        Scene packet bytes
+    """
+    if scene_type is None:
+        scene_type = rng.choices(
+            [t for t, _, _ in SYNTHETIC_SCENE_PACKETS],
+            [w for _, w, _ in SYNTHETIC_SCENE_PACKETS],
+        )[0]
+    if size is None:
+        low, high = next(r for t, _, r in SYNTHETIC_SCENE_PACKETS if t == scene_type)
+        # Small packets are far more common than large ones
+        size = low + int((high - low) * rng.random() ** 3)
+    size = max(size, 1)
+    
+    payload = bytearray(rng.choices(range(256), freqs, k=size))
+    for i in range(size):
+        if rng.random() < SYNTHETIC_RAW_SHARE:
+            payload[i] = rng.randrange(256)
+    
+    payload[0] = scene_type
+    offset = MESSAGE_TYPE_OFFSETS.get(scene_type)
+    if offset is not None and size > offset:
+        payload[offset] = rng.choices(
+            [t for t, _ in SYNTHETIC_MESSAGE_TYPES],
+            [w for _, w in SYNTHETIC_MESSAGE_TYPES],
+        )[0]
+    return bytes(payload)
+
+
+def generate_corpus(count, seed=0, scene_type=None, size=None, freqs=G_FREQS):
+    """
+    Generate a reproducible list of synthetic scene packets.
+    
+    Args:
+        count: Number of packets
+        seed: Random seed (same seed = same corpus)
+        scene_type, size, freqs: See generate_scene_packet()
+        
+    Returns:
+        List of scene packet bytes
+    """
+    rng = random.Random(seed)
+    return [generate_scene_packet(rng, scene_type, size, freqs) for _ in range(count)]
+
+
+# ============================================================================
+# FREQUENCY TABLE TRAINING
+# ============================================================================
+
+# Scene packets FrequencyTrainer keeps per histogram to rank tables with
+# evaluate_table() (a uniform random sample of everything added)
+TRAINER_SAMPLE_PACKETS = 2048
+
+
+def _code_bits(freqs):
+    """
+    Code lengths of a frequency table.
+    
+    Candidate tables are only scored, so unless a codec already uses the
+    table its tree is built here without going through HuffmanCodec and
+    _TABLE_CACHE (which keeps every table it sees).
+    """
+    freqs = tuple(freqs)
+    tables = _TABLE_CACHE.get(freqs)
+    if tables is not None:
+        return tables["code_bits"]
+    if len(freqs) != 256 or any(f < 0 for f in freqs):
+        raise ValueError("Frequency table must hold 256 non-negative counts")
+    return tuple(_build_tree(freqs)[4])
+
+
+def prune_table(counts):
+    """
+    Turn a byte histogram into the frequency table that encodes it best.
+    
+    Every byte with a nonzero count gets a leaf high in the tree, but bytes
+    whose code reaches 8 bits are sent as 9-bit raw values anyway, so their
+    counts only push the common bytes' codes longer. Such bytes are zeroed
+    and the tree rebuilt until no counted byte falls back to raw; the
+    table with the lowest expected size on counts is returned.
+    
+    Args:
+        counts: 256 byte counts (list or collections.Counter)
+        
+    Returns:
+        Frequency table (list of 256 ints)
+    """
+    counts = [counts[b] for b in range(256)]
+    table = best = counts
+    best_bits = None
+    while True:
+        code_bits = _code_bits(table)
+        bits = sum(c * n for c, n in zip(counts, code_bits))
+        if best_bits is None or bits < best_bits:
+            best, best_bits = table, bits
+        raw = [b for b in range(256) if table[b] and code_bits[b] > 8]
+        if not raw:
+            return best
+        table = list(table)
+        for b in raw:
+            table[b] = 0
+
+
+def expected_bits_per_byte(counts, freqs=G_FREQS):
+    """
+    Expected encoded bits per input byte for a byte histogram under a table.
+    
+    Counts code bits only (no header byte or raw fallback per packet), which
+    makes it cheap to compare tables on large histograms.
+    
+    Args:
+        counts: 256 byte counts (list or collections.Counter)
+        freqs: Frequency table to evaluate
+        
+    Returns:
+        Average code bits per byte (8.0 = no gain), or 0.0 for an empty histogram
+    """
+    code_bits = _code_bits(freqs)
+    total = sum(counts[b] for b in range(256))
+    if not total:
+        return 0.0
+    return sum(counts[b] * code_bits[b] for b in range(256)) / total
+
+
+def evaluate_table(packets, freqs=G_FREQS):
+    """
+    Exact compressed bits per input byte of packets under a table.
+    
+    Includes the header byte and the "return the original if compression
+    doesn't help" rule of compress(). Only the sizes are computed, so the
+    packets aren't actually compressed and no codec is built for the table.
+    
+    Args:
+        packets: Scene packets (first byte high bit clear)
+        freqs: Frequency table to evaluate
+        
+    Returns:
+        Compressed bits per byte, or 0.0 if packets is empty
+        
+    Raises:
+        ValueError: If a packet's first byte has high bit set
+    """
+    code_bits = _code_bits(freqs)
+    total = compressed = 0
+    for packet in packets:
+        if not packet:
+            continue
+        if packet[0] & 0x80:
+            raise ValueError("First byte must have high bit clear (required for compression flag)")
+        # Same size rule as compress()
+        length_out = (sum(map(code_bits.__getitem__, packet)) + 7) // 8 + 1
+        total += len(packet)
+        compressed += min(length_out, len(packet))
+    return compressed * 8 / total if total else 0.0
+
+
+class FrequencyTrainer:
+    """
+    Build byte frequency tables from captured scene packets.
+    
+    Bytes are counted for all traffic together ("all"), per direction
+    ("packet_type=36" / "packet_type=37") and per scene packet type
+    ("scene_type=17", ...). Each histogram can be turned into a candidate
+    table for HuffmanCodec(freqs=...) (see prune_table()).
+    
+    A random sample of up to TRAINER_SAMPLE_PACKETS packets per histogram is
+    kept so report() can rank tables by exact compressed size.
+    
+    Usage:
+        trainer = FrequencyTrainer()
+        trainer.add_capture("session.pcapng")
+        for row in trainer.report():
+            print(row)
+        codec = HuffmanCodec(freqs=trainer.tables()["all"])
+    """
+    
+    def __init__(self, sample_packets=TRAINER_SAMPLE_PACKETS, seed=0):
+        """
+        Args:
+            sample_packets: Packets sampled per histogram for report()
+            seed: Seed of the sampling
+        """
+        self.counts = collections.defaultdict(collections.Counter)
+        self.packets = collections.Counter()
+        self.samples = collections.defaultdict(list)
+        self.sample_packets = sample_packets
+        self._rng = random.Random(seed)
+    
+    def add(self, scene_packet, packet_type=None):
+        """
+        Count the bytes of one decompressed scene packet.
+        
+        Args:
+            scene_packet: Decompressed scene packet bytes
+            packet_type: BA_PACKET_* type it arrived in (direction), if known
+        """
+        if len(scene_packet) == 0:
+            return
+        keys = ["all", f"scene_type={scene_packet[0]}"]
+        if packet_type is not None:
+            keys.append(f"packet_type={packet_type}")
+        for key in keys:
+            # Counter.update() counts an iterable of ints in C
+            self.counts[key].update(scene_packet)
+            self.packets[key] += 1
+            
+            # Reservoir sampling keeps every packet with equal probability
+            sample = self.samples[key]
+            if len(sample) < self.sample_packets:
+                sample.append(bytes(scene_packet))
+            else:
+                index = self._rng.randrange(self.packets[key])
+                if index < self.sample_packets:
+                    sample[index] = bytes(scene_packet)
+    
+    def add_capture(self, path, packet_types=GAMEPACKET_TYPES, codec=None):
+        """
+        Stream a capture file and count every decodable scene packet.
+        
+        Args:
+            path: Path to a .pcap or .pcapng file
+            packet_types: BA_PACKET_* types to count
+            codec: Codec the capture was compressed with (default: G_FREQS)
+            
+        Returns:
+            Number of scene packets counted
+        """
+        # Capture reading lives in its own module (it needs mmap and a process pool)
+        from huffman_bs_capture import iter_game_packets
+        
+        count = 0
+        for packet_type, _, scene_packet in iter_game_packets(path, packet_types, codec):
+            if scene_packet is not None:
+                self.add(scene_packet, packet_type)
+                count += 1
+        return count
+    
+    def tables(self, min_packets=1, scale=None):
+        """
+        Turn the histograms into candidate frequency tables.
+        
+        Each table is pruned with prune_table(), so bytes that would be sent
+        raw anyway don't lengthen the other codes.
+        
+        Args:
+            min_packets: Skip histograms built from fewer packets
+            scale: If given, scale each table so its counts sum to about this
+                (keeping every seen byte at 1 or more)
+            
+        Returns:
+            Dict of histogram key -> frequency table (list of 256 ints)
+        """
+        tables = {}
+        for key, counts in self.counts.items():
+            if self.packets[key] < min_packets:
+                continue
+            table = prune_table(counts)
+            if scale:
+                total = sum(table)
+                table = [max(1, round(c * scale / total)) if c else 0 for c in table]
+            tables[key] = table
+        return tables
+    
+    def report(self, tables=None):
+        """
+        Compare candidate tables (and G_FREQS) on every histogram.
+        
+        Args:
+            tables: Dict of name -> frequency table (default: self.tables())
+            
+        Returns:
+            List of dicts (one per histogram) with key, packets, bytes,
+            bits_per_byte: {table name: expected_bits_per_byte()},
+            exact_bits_per_byte: {table name: evaluate_table() on the
+            histogram's packet sample} and ranking: table names from the
+            smallest to the largest exact size
+        """
+        if tables is None:
+            tables = self.tables()
+        tables = dict(tables, G_FREQS=G_FREQS)
+        
+        rows = []
+        for key, counts in sorted(self.counts.items()):
+            exact = {
+                name: evaluate_table(self.samples[key], table)
+                for name, table in tables.items()
+            }
+            rows.append({
+                "key": key,
+                "packets": self.packets[key],
+                "bytes": sum(counts.values()),
+                "bits_per_byte": {
+                    name: expected_bits_per_byte(counts, table)
+                    for name, table in tables.items()
+                },
+                "exact_bits_per_byte": exact,
+                "ranking": sorted(exact, key=exact.get),
+            })
+        return rows
+
+
 # ============================================================================
 # MAIN / TESTING
 # ============================================================================
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        import huffman_bs_cli
+        sys.exit(huffman_bs_cli.main())
+    
     print("=" * 70)
     print("BombSquad/Ballistica Huffman Packet Codec")
     print("=" * 70)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+huffman_bs_bench.py - Benchmark suite for the BombSquad Huffman codec
+
+Measures the hot paths of huffman_bs.HuffmanCodec on a reproducible synthetic
+corpus (see huffman_bs.generate_corpus) and writes the results as JSON, so
+runs on different commits can be compared.
+
+Usage:
+    # Run all benchmarks and print JSON
+    python huffman_bs_bench.py
+
+    # Save results, then compare a later run against them
+    python huffman_bs_bench.py --output bench_output.txt
+    python huffman_bs_bench.py --compare bench_output.txt
+
+    # Check every decode engine against the tree walk instead of benchmarking
+    python huffman_bs_bench.py --verify
+
+    # Measure compress/decompress throughput of one codec shared by 1-8 threads
+    python huffman_bs_bench.py --threads 1,2,4,8
+
+Every benchmark reports throughput (packets/s, input MB/s) and per-call
+latency percentiles in microseconds.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import huffman_bs
+import huffman_bs_min
+from huffman_bs import HuffmanCodec, generate_corpus
+
+# Corpus size buckets (label, scene packet size or None for the realistic mix)
+CORPUS_BUCKETS = (
+    ("mixed", None),
+    ("small_15", 15),
+    ("medium_128", 128),
+    ("large_1200", 1200),
+)
+
+# Latency percentiles reported per benchmark
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Slowdown (fraction of median latency added) reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.10
+
+# Thread counts measured by --threads without a list
+THREAD_COUNTS = (1, 2, 4, 8)
+
+# Directory of this script (and the codec modules), so subprocesses find them
+# wherever the suite is run from
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+def percentile(sorted_values, pct):
+    """Return the pct-th percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(func, inputs, rounds):
+    """
+    Call func on every input, rounds times, timing each call.
+
+    Args:
+        func: Callable taking one input
+        inputs: List of inputs (bytes)
+        rounds: Number of passes over inputs
+
+    Returns:
+        Dict with calls, packets_per_s, mb_per_s and latency_us percentiles
+    """
+    clock = time.perf_counter_ns
+    timings = []
+    record = timings.append
+    total_bytes = sum(len(data) for data in inputs) * rounds
+
+    for _ in range(rounds):
+        for data in inputs:
+            start = clock()
+            func(data)
+            record(clock() - start)
+
+    timings.sort()
+    seconds = sum(timings) / 1e9
+    return {
+        "calls": len(timings),
+        "packets_per_s": len(timings) / seconds if seconds else 0.0,
+        "mb_per_s": total_bytes / seconds / 1e6 if seconds else 0.0,
+        "latency_us": {f"p{pct:g}": percentile(timings, pct) / 1e3 for pct in PERCENTILES},
+    }
+
+
+# ============================================================================
+# BENCHMARKS
+# ============================================================================
+
+def bench_build(rounds):
+    """Time a full Huffman tree build (bypassing the shared table cache)"""
+    codec = HuffmanCodec()
+
+    return measure(lambda _: codec.build(), [b""] * rounds, 1)
+
+
+def bench_construct(rounds):
+    """Time HuffmanCodec() with the shared table cache warm (a codec per packet)"""
+    HuffmanCodec()
+    return measure(lambda _: HuffmanCodec(), [b""] * rounds, 1)
+
+
+# Statements timed in a fresh interpreter by bench_import()
+IMPORT_BENCHMARKS = {
+    "import+construct": "import huffman_bs; huffman_bs.HuffmanCodec()",
+    "import+encode[huffman_bs_min]":
+        "import huffman_bs_min; huffman_bs_min.HuffmanCodec().e(bytes(range(40)))",
+}
+
+
+def bench_import(runs):
+    """
+    Time importing the codec and using it once in a fresh Python process.
+
+    This is the startup cost of a short-lived tool or a freshly loaded mod,
+    which warm in-process benchmarks can't see.
+
+    Returns:
+        Dict of benchmark name -> dict with calls and latency_us percentiles
+    """
+    results = {}
+    for name, statement in IMPORT_BENCHMARKS.items():
+        script = (
+            "import time\n"
+            "start = time.perf_counter_ns()\n"
+            f"{statement}\n"
+            "print(time.perf_counter_ns() - start)\n"
+        )
+        timings = sorted(
+            int(subprocess.run([sys.executable, "-c", script], capture_output=True,
+                               text=True, check=True, cwd=BENCH_DIR).stdout)
+            for _ in range(runs)
+        )
+        results[name] = {
+            "calls": runs,
+            "latency_us": {f"p{pct:g}": percentile(timings, pct) / 1e3 for pct in PERCENTILES},
+        }
+    return results
+
+
+def bench_codec(corpus, rounds):
+    """
+    Time compress, decompress (per engine) and encode_full_packet on a corpus.
+
+    Returns:
+        Dict of benchmark name -> measure() result
+    """
+    results = {}
+    for engine in huffman_bs.ENCODE_ENGINES:
+        codec = HuffmanCodec(encode_engine=engine)
+        results[f"compress[{engine}]"] = measure(codec.compress, corpus, rounds)
+
+    codec = HuffmanCodec()
+    compressed = [codec.compress(data) for data in corpus]
+    for engine in huffman_bs.DECODE_ENGINES:
+        codec = HuffmanCodec(decode_engine=engine)
+        results[f"decompress[{engine}]"] = measure(codec.decompress, compressed, rounds)
+
+    codec = HuffmanCodec()
+    results["encode_full_packet"] = measure(codec.encode_full_packet, corpus, rounds)
+    return results
+
+
+def bench_threads(corpus, rounds, thread_counts=THREAD_COUNTS):
+    """
+    Time compress and decompress on one codec shared by several threads.
+
+    Every thread makes rounds passes over the whole corpus, so with perfect
+    scaling packets/s grows with the thread count. With the GIL the threads
+    take turns and packets/s stays flat; free-threaded builds run them in
+    parallel. Each thread's last pass is also checked against a
+    single-threaded run, which catches any state shared between calls.
+
+    Returns:
+        Dict of "compress/threads=N" and "decompress/threads=N" -> dict with
+        threads, calls, seconds, packets_per_s, speedup (over one thread)
+        and mismatches
+    """
+    codec = HuffmanCodec()
+    compressed = [codec.compress(data) for data in corpus]
+    operations = (
+        ("compress", codec.compress, corpus, compressed),
+        ("decompress", codec.decompress, compressed, corpus),
+    )
+
+    results = {}
+    for name, func, inputs, expected in operations:
+        single = None
+        for threads in thread_counts:
+            barrier = threading.Barrier(threads + 1)
+            outputs = [None] * threads
+
+            def worker(index):
+                barrier.wait()
+                for _ in range(rounds - 1):
+                    for data in inputs:
+                        func(data)
+                outputs[index] = [func(data) for data in inputs]
+
+            pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+            for thread in pool:
+                thread.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for thread in pool:
+                thread.join()
+            seconds = time.perf_counter() - start
+
+            calls = threads * rounds * len(inputs)
+            packets_per_s = calls / seconds if seconds else 0.0
+            if single is None:
+                single = packets_per_s
+            results[f"{name}/threads={threads}"] = {
+                "threads": threads,
+                "calls": calls,
+                "seconds": seconds,
+                "packets_per_s": packets_per_s,
+                "speedup": packets_per_s / single if single else 0.0,
+                "mismatches": sum(output != expected for output in outputs),
+            }
+    return results
+
+
+def run_threads(packets, rounds, seed, thread_counts=THREAD_COUNTS):
+    """
+    Run bench_threads() on the mixed corpus.
+
+    Returns:
+        JSON-serialisable dict with run metadata and results
+    """
+    corpus = generate_corpus(packets, seed=seed)
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "gil_enabled": is_gil_enabled() if is_gil_enabled is not None else True,
+            "cpus": os.cpu_count(),
+            "packets": packets,
+            "rounds": rounds,
+            "seed": seed,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": bench_threads(corpus, rounds, thread_counts),
+    }
+
+
+def run(packets, rounds, seed):
+    """
+    Run every benchmark.
+
+    Returns:
+        JSON-serialisable dict with run metadata and results
+    """
+    results = {
+        "build": bench_build(max(rounds, 20)),
+        "construct": bench_construct(max(rounds, 20) * 10),
+    }
+    results.update(bench_import(max(rounds, 10)))
+    for label, size in CORPUS_BUCKETS:
+        corpus = generate_corpus(packets, seed=seed, size=size)
+        codec = HuffmanCodec()
+        ratio = sum(len(codec.compress(d)) for d in corpus) / sum(len(d) for d in corpus)
+        for name, result in bench_codec(corpus, rounds).items():
+            result["compression_ratio"] = ratio
+            results[f"{name}/{label}"] = result
+
+    numpy = huffman_bs._numpy()
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "numpy": numpy.__version__ if numpy is not None else None,
+            "packets": packets,
+            "rounds": rounds,
+            "seed": seed,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def git_commit():
+    """Return the current git commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=BENCH_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare two run() results by median latency (less noisy than the mean).
+
+    Returns:
+        List of (name, baseline p50 us, current p50 us, change) for
+        benchmarks whose median call got slower by more than threshold
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old or not old["latency_us"]["p50"]:
+            continue
+        old_p50 = old["latency_us"]["p50"]
+        new_p50 = result["latency_us"]["p50"]
+        change = new_p50 / old_p50 - 1
+        if change > threshold:
+            regressions.append((name, old_p50, new_p50, change))
+    return regressions
+
+
+# ============================================================================
+# VERIFICATION
+# ============================================================================
+
+def _outcome(func, data):
+    """Return a comparable result of func(data): the output or the error raised"""
+    try:
+        return bytes(func(data))
+    except Exception as e:
+        return type(e).__name__, str(e)
+
+
+def verification_inputs(packets, seed):
+    """
+    Yield compressed inputs exercising the decoders' normal and error paths.
+
+    For each synthetic packet: its compressed form, truncations of it (the
+    shortest and longest two plus a few random ones), a copy with one bit
+    flipped, and random bytes with the compressed flag set (which reach
+    tree paths longer than any real code, i.e. dead-end nodes and truncated
+    raw values).
+    """
+    rng = random.Random(seed)
+    codec = HuffmanCodec()
+    for data in generate_corpus(packets, seed=seed):
+        compressed = codec.compress(data)
+        yield compressed
+        lengths = {1, 2, len(compressed) - 2, len(compressed) - 1}
+        lengths.update(rng.sample(range(1, len(compressed)), min(4, len(compressed) - 1)))
+        for length in sorted(lengths):
+            if length > 0:
+                yield compressed[:length]
+        flipped = bytearray(compressed)
+        flipped[rng.randrange(len(flipped))] ^= 1 << rng.randrange(8)
+        yield bytes(flipped)
+        yield bytes([0x80 | rng.randrange(16)]) + rng.randbytes(rng.randrange(40))
+
+
+def verify(packets, seed):
+    """
+    Check every decode engine against decode_engine="tree", and
+    huffman_bs_min against huffman_bs.
+
+    huffman_bs_min raises shorter error messages for invalid headers and
+    inputs, so only its exception types are compared.
+
+    Returns:
+        List of (engine, input hex, expected, got) for every mismatch, where
+        expected/got are the output bytes or an (exception type, message) pair
+    """
+    reference = HuffmanCodec(decode_engine="tree")
+    engines = {
+        engine: HuffmanCodec(decode_engine=engine)
+        for engine in huffman_bs.DECODE_ENGINES if engine != "tree"
+    }
+    minimal = huffman_bs_min.HuffmanCodec()
+    mismatches = []
+
+    def check_minimal(name, func, expected_func, data):
+        expected = _outcome(expected_func, data)
+        got = _outcome(func, data)
+        if isinstance(expected, tuple):
+            same = isinstance(got, tuple) and got[0] == expected[0]
+        else:
+            same = got == expected
+        if not same:
+            mismatches.append((name, data.hex(), expected, got))
+
+    for data in verification_inputs(packets, seed):
+        expected = _outcome(reference.decompress, data)
+        for engine, codec in engines.items():
+            got = _outcome(codec.decompress, data)
+            if got != expected:
+                mismatches.append((engine, data.hex(), expected, got))
+        check_minimal("huffman_bs_min.d", minimal.d, reference.decompress, data)
+
+    # Compressible packets, incompressible ones (returned as-is), empty input
+    # and a first byte with the high bit set (rejected)
+    rng = random.Random(seed)
+    inputs = generate_corpus(packets, seed=seed)
+    inputs += [bytes([rng.randrange(128)]) + rng.randbytes(rng.randrange(40))
+               for _ in range(packets)]
+    inputs += [b"", bytes([0x80 | rng.randrange(128)]) + rng.randbytes(8)]
+    for data in inputs:
+        check_minimal("huffman_bs_min.c", minimal.c, reference.compress, data)
+        check_minimal("huffman_bs_min.e", minimal.e, reference.encode_full_packet, data)
+    return mismatches
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the BombSquad Huffman codec")
+    parser.add_argument("--packets", type=int, default=500, help="corpus packets per bucket")
+    parser.add_argument("--rounds", type=int, default=5, help="passes over each corpus")
+    parser.add_argument("--seed", type=int, default=0, help="corpus random seed")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="report benchmarks slower than a previous JSON result")
+    parser.add_argument("--verify", action="store_true",
+                        help="check decode engines against the tree walk instead of benchmarking")
+    parser.add_argument("--threads", nargs="?", const=",".join(map(str, THREAD_COUNTS)),
+                        metavar="COUNTS",
+                        help="measure throughput of one codec shared by each of these "
+                             "comma-separated thread counts instead")
+    args = parser.parse_args(argv)
+    if args.threads and args.compare:
+        parser.error("--compare only applies to the benchmark suite")
+
+    if args.verify:
+        mismatches = verify(args.packets, args.seed)
+        for engine, data, expected, got in mismatches[:20]:
+            print(f"MISMATCH {engine} {data}: expected {expected!r}, got {got!r}",
+                  file=sys.stderr)
+        print(f"{len(mismatches)} mismatches", file=sys.stderr)
+        return 1 if mismatches else 0
+
+    if args.threads:
+        thread_counts = [int(count) for count in args.threads.split(",")]
+        report = run_threads(args.packets, args.rounds, args.seed, thread_counts)
+    else:
+        report = run(args.packets, args.rounds, args.seed)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report)
+        for name, old, new, change in regressions:
+            print(f"REGRESSION {name}: p50 {old:.1f}us -> {new:.1f}us ({change:+.1%})",
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,467 @@
+"""
+huffman_bs_capture.py - pcap/pcapng capture reading for the BombSquad Huffman codec
+
+Streams UDP payloads and decompressed game packets out of capture files.
+Files are memory-mapped and read one record at a time, so captures of any
+size are processed in constant memory. Whole captures can also be decoded
+on a process pool, one HuffmanCodec per worker.
+
+Usage:
+    # Decompress the game packets of a capture
+    for packet_type, client_id, scene_packet in iter_game_packets("session.pcapng"):
+        ...
+
+    # Same, decoded on all cores and yielded in capture order
+    for packet_type, client_id, scene_packet in decode_capture_parallel("session.pcapng"):
+        ...
+
+    # Decode throughput with 0 (in-process), 1, 2, 4, ... workers
+    benchmark_parallel_scaling("session.pcapng")
+"""
+
+import collections
+import concurrent.futures
+import mmap
+import os
+import struct
+import time
+
+from huffman_bs import GAMEPACKET_TYPES, HuffmanCodec
+
+# ============================================================================
+# CAPTURE FILES (pcap / pcapng)
+# ============================================================================
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SECTION_HEADER = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+
+# Link-layer header types (from the pcap LINKTYPE_* registry)
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+IPPROTO_UDP = 17
+
+# IPv6 extension headers skipped on the way to the UDP header
+_IPV6_EXTENSION_HEADERS = (0, 43, 60)
+
+
+def _ip_udp_payload(frame, offset):
+    """Return the UDP payload of the IPv4/IPv6 packet at offset, or None"""
+    if len(frame) < offset + 1:
+        return None
+    version = frame[offset] >> 4
+
+    if version == 4:
+        header_len = (frame[offset] & 0x0F) * 4
+        if len(frame) < offset + 20 or frame[offset + 9] != IPPROTO_UDP:
+            return None
+        # Skip fragments (only the first one has a UDP header)
+        if ((frame[offset + 6] << 8) | frame[offset + 7]) & 0x3FFF:
+            return None
+        offset += header_len
+    elif version == 6:
+        if len(frame) < offset + 40:
+            return None
+        next_header = frame[offset + 6]
+        offset += 40
+        while next_header in _IPV6_EXTENSION_HEADERS and len(frame) >= offset + 2:
+            next_header = frame[offset]
+            offset += (frame[offset + 1] + 1) * 8
+        if next_header != IPPROTO_UDP:
+            return None
+    else:
+        return None
+
+    if len(frame) < offset + 8:
+        return None
+    udp_len = (frame[offset + 4] << 8) | frame[offset + 5]
+    end = min(offset + udp_len, len(frame)) if udp_len >= 8 else len(frame)
+    return frame[offset + 8:end]
+
+
+def _link_udp_payload(frame, linktype):
+    """Return the UDP payload of a captured frame, or None if it isn't UDP"""
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        while len(frame) >= offset + 2:
+            ethertype = (frame[offset] << 8) | frame[offset + 1]
+            if ethertype in ETHERTYPE_VLAN:
+                offset += 4
+                continue
+            if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+                return None
+            return _ip_udp_payload(frame, offset + 2)
+        return None
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return _ip_udp_payload(frame, 0)
+    if linktype == LINKTYPE_NULL:
+        return _ip_udp_payload(frame, 4)
+    if linktype == LINKTYPE_LINUX_SLL:
+        return _ip_udp_payload(frame, 16)
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return _ip_udp_payload(frame, 20)
+    return None
+
+
+def _iter_pcap_frames(view, endian):
+    """Yield (linktype, frame) for every record of a classic pcap file"""
+    linktype = struct.unpack_from(endian + "I", view, 20)[0] & 0x0FFFFFFF
+    record = struct.Struct(endian + "IIII")
+    offset = 24
+    while offset + 16 <= len(view):
+        _, _, incl_len, _ = record.unpack_from(view, offset)
+        offset += 16
+        yield linktype, view[offset:offset + incl_len]
+        offset += incl_len
+
+
+def _pcapng_linktype(linktypes, interface, offset):
+    """Link type of a pcapng packet block's interface"""
+    if interface >= len(linktypes):
+        raise ValueError(f"pcapng packet block at offset {offset} refers to "
+                         f"unknown interface {interface}")
+    return linktypes[interface]
+
+
+def _iter_pcapng_frames(view):
+    """
+    Yield (linktype, frame) for every packet block of a pcapng file.
+
+    A block cut off by the end of the file (e.g. a capture still being
+    written) ends the iteration.
+
+    Raises:
+        ValueError: If a block is malformed or refers to an unknown interface
+    """
+    endian = "<"
+    linktypes = []
+    offset = 0
+    while offset + 12 <= len(view):
+        block_type = struct.unpack_from(endian + "I", view, offset)[0]
+
+        if block_type == PCAPNG_SECTION_HEADER:
+            # Each section sets its own byte order and interface list
+            magic = struct.unpack_from("<I", view, offset + 8)[0]
+            endian = "<" if magic == PCAPNG_BYTE_ORDER_MAGIC else ">"
+            linktypes = []
+
+        block_len = struct.unpack_from(endian + "I", view, offset + 4)[0]
+        if block_len < 12:
+            raise ValueError(f"Invalid pcapng block length {block_len} at offset {offset}")
+        if offset + block_len > len(view):
+            return
+        # Body of the block, between the length and the trailing length
+        body_len = block_len - 12
+
+        if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+            if body_len < 2:
+                raise ValueError(f"Invalid pcapng interface block at offset {offset}")
+            linktypes.append(struct.unpack_from(endian + "H", view, offset + 8)[0])
+        elif block_type == PCAPNG_ENHANCED_PACKET:
+            if body_len < 20:
+                raise ValueError(f"Invalid pcapng packet block at offset {offset}")
+            interface, _, _, captured_len, _ = struct.unpack_from(endian + "IIIII", view, offset + 8)
+            start = offset + 28
+            yield (_pcapng_linktype(linktypes, interface, offset),
+                   view[start:start + min(captured_len, body_len - 20)])
+        elif block_type == PCAPNG_SIMPLE_PACKET:
+            if body_len < 4:
+                raise ValueError(f"Invalid pcapng packet block at offset {offset}")
+            original_len = struct.unpack_from(endian + "I", view, offset + 8)[0]
+            start = offset + 12
+            yield (_pcapng_linktype(linktypes, 0, offset),
+                   view[start:start + min(original_len, body_len - 4)])
+
+        offset += block_len
+
+
+def iter_udp_payloads(path, packet_types=None):
+    """
+    Stream UDP payloads out of a pcap or pcapng capture file.
+
+    The file is memory-mapped and every payload is yielded as a memoryview
+    into the mapping, so memory use doesn't grow with the capture size.
+    Payloads are only valid while the generator is running.
+
+    Args:
+        path: Path to a .pcap or .pcapng file
+        packet_types: Only yield payloads whose first byte (the BA_PACKET_*
+            type) is in this collection, or None for all UDP payloads
+
+    Yields:
+        UDP payloads as memoryviews
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        # Read ahead and let the kernel drop pages behind the read position
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+    view = memoryview(mapped)
+    try:
+        if len(view) < 24:
+            raise ValueError("Capture file too short")
+        magic_le = struct.unpack_from("<I", view, 0)[0]
+        magic_be = struct.unpack_from(">I", view, 0)[0]
+        if magic_le == PCAPNG_SECTION_HEADER:
+            frames = _iter_pcapng_frames(view)
+        elif magic_le in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            frames = _iter_pcap_frames(view, "<")
+        elif magic_be in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            frames = _iter_pcap_frames(view, ">")
+        else:
+            raise ValueError(f"Not a pcap/pcapng file (magic 0x{magic_le:08x})")
+
+        for linktype, frame in frames:
+            payload = _link_udp_payload(frame, linktype)
+            if payload is None or len(payload) == 0:
+                continue
+            if packet_types is not None and payload[0] not in packet_types:
+                continue
+            yield payload
+    finally:
+        frames = frame = payload = None
+        try:
+            view.release()
+            mapped.close()
+        except BufferError:
+            # The caller still holds payload views; the mapping is closed
+            # once they are garbage collected
+            pass
+
+
+def iter_game_packets(path, packet_types=GAMEPACKET_TYPES, codec=None):
+    """
+    Stream and decompress game packets out of a capture file.
+
+    Payloads are decompressed lazily, one at a time, as the generator is
+    consumed.
+
+    Args:
+        path: Path to a .pcap or .pcapng file
+        packet_types: BA_PACKET_* types to decode (default: compressed game packets)
+        codec: HuffmanCodec to decompress with (default: a new one)
+
+    Yields:
+        Tuples of (packet_type, client_id, scene_packet), where scene_packet
+        is None if the payload could not be decompressed. Payloads too short
+        to hold a compressed scene packet are skipped.
+    """
+    if codec is None:
+        codec = HuffmanCodec()
+
+    for payload in iter_udp_payloads(path, packet_types):
+        if len(payload) < 3:
+            continue
+        try:
+            scene_packet = codec.decompress(payload[2:])
+        except (ValueError, IndexError):
+            scene_packet = None
+        yield payload[0], payload[1], scene_packet
+
+
+# ============================================================================
+# PARALLEL DECODING
+# ============================================================================
+
+# Codec of the current decode worker process (see _init_decode_worker)
+_worker_codec = None
+
+
+def _init_decode_worker(decode_engine, freqs=None):
+    """Process pool initializer: build one codec per worker process"""
+    global _worker_codec
+    _worker_codec = HuffmanCodec(decode_engine=decode_engine, freqs=freqs)
+
+
+def _decode_chunk(chunk):
+    """
+    Decompress one chunk of payloads in a worker process.
+
+    Args:
+        chunk: Tuple of (data, offsets) holding the compressed payloads back
+            to back, as accepted by HuffmanCodec.decompress_many()
+
+    Returns:
+        Tuple of (output, out_offsets, failed), where failed lists the
+        indexes of payloads that could not be decompressed (their output
+        is empty)
+    """
+    data, offsets = chunk
+    codec = _worker_codec
+    try:
+        output, out_offsets = codec.decompress_many(data, offsets)
+        return output, out_offsets, []
+    except (ValueError, IndexError):
+        pass
+
+    # Some payload is malformed, decode one by one to find it
+    view = memoryview(data)
+    output = bytearray()
+    out_offsets = [0]
+    failed = []
+    for i in range(len(offsets) - 1):
+        try:
+            output += codec.decompress(view[offsets[i]:offsets[i + 1]])
+        except (ValueError, IndexError):
+            failed.append(i)
+        out_offsets.append(len(output))
+    return output, out_offsets, failed
+
+
+def decode_capture_parallel(path, workers=None, chunk_packets=4096,
+                            packet_types=GAMEPACKET_TYPES, decode_engine="table",
+                            stats=None, freqs=None):
+    """
+    Decompress the game packets of a capture file on multiple cores.
+
+    The capture is streamed in chunks of chunk_packets payloads, which are
+    decoded by a process pool (one codec per worker) and yielded back in
+    capture order. At most two chunks per worker are in flight, so memory
+    use stays bounded for any capture size.
+
+    Args:
+        path: Path to a .pcap or .pcapng file
+        workers: Number of worker processes (default: CPU count), or 0 to
+            decode in this process
+        chunk_packets: Payloads sent to a worker at a time
+        packet_types: BA_PACKET_* types to decode (default: compressed game packets)
+        decode_engine: Decode engine used by the workers' codecs
+        stats: Optional dict that receives packet and byte totals
+        freqs: Frequency table of the workers' codecs (default: G_FREQS)
+
+    Yields:
+        Tuples of (packet_type, client_id, scene_packet) like
+        iter_game_packets(), with scene_packet None if it failed to decode
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if stats is None:
+        stats = {}
+    stats.update(packets=0, failed=0, bytes_in=0, bytes_out=0)
+
+    def chunks():
+        headers = []
+        data = bytearray()
+        offsets = [0]
+        for payload in iter_udp_payloads(path, packet_types):
+            if len(payload) < 3:
+                continue
+            headers.append((payload[0], payload[1]))
+            data += payload[2:]
+            offsets.append(len(data))
+            if len(headers) >= chunk_packets:
+                yield headers, data, offsets
+                headers = []
+                data = bytearray()
+                offsets = [0]
+        if headers:
+            yield headers, data, offsets
+
+    def results(headers, output, out_offsets, failed):
+        stats["packets"] += len(headers)
+        stats["failed"] += len(failed)
+        stats["bytes_out"] += len(output)
+        failed = set(failed)
+        for i, (packet_type, client_id) in enumerate(headers):
+            if i in failed:
+                yield packet_type, client_id, None
+            else:
+                yield packet_type, client_id, bytes(output[out_offsets[i]:out_offsets[i + 1]])
+
+    if workers == 0:
+        _init_decode_worker(decode_engine, freqs)
+        for headers, data, offsets in chunks():
+            stats["bytes_in"] += len(data)
+            yield from results(headers, *_decode_chunk((data, offsets)))
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_decode_worker,
+        initargs=(decode_engine, freqs),
+    ) as pool:
+        pending = collections.deque()
+        for headers, data, offsets in chunks():
+            stats["bytes_in"] += len(data)
+            pending.append((headers, pool.submit(_decode_chunk, (data, offsets))))
+            if len(pending) >= 2 * workers:
+                headers, future = pending.popleft()
+                yield from results(headers, *future.result())
+        while pending:
+            headers, future = pending.popleft()
+            yield from results(headers, *future.result())
+
+
+def measure_parallel_decode(path, workers=None, **kwargs):
+    """
+    Decode a whole capture with decode_capture_parallel() and time it.
+
+    Args:
+        path: Path to a .pcap or .pcapng file
+        workers: Number of worker processes (see decode_capture_parallel)
+        **kwargs: Passed on to decode_capture_parallel()
+
+    Returns:
+        Dict with workers, packets, failed, bytes_in, bytes_out, seconds,
+        packets_per_s and mb_per_s (compressed input MB/s)
+    """
+    stats = {}
+    start = time.perf_counter()
+    for _ in decode_capture_parallel(path, workers=workers, stats=stats, **kwargs):
+        pass
+    seconds = time.perf_counter() - start
+
+    stats["workers"] = (os.cpu_count() or 1) if workers is None else workers
+    stats["seconds"] = seconds
+    stats["packets_per_s"] = stats["packets"] / seconds if seconds else 0.0
+    stats["mb_per_s"] = stats["bytes_in"] / seconds / 1e6 if seconds else 0.0
+    return stats
+
+
+def benchmark_parallel_scaling(path, worker_counts=None, verbose=True, **kwargs):
+    """
+    Measure decode throughput of a capture for several worker counts.
+
+    Args:
+        path: Path to a .pcap or .pcapng file
+        worker_counts: Worker counts to try (default: 0 (in-process), then
+            1, 2, 4, ... up to the CPU count)
+        verbose: Print a table of the results
+        **kwargs: Passed on to decode_capture_parallel()
+
+    Returns:
+        List of measure_parallel_decode() results
+    """
+    if worker_counts is None:
+        cpus = os.cpu_count() or 1
+        worker_counts = [0, 1]
+        while worker_counts[-1] * 2 <= cpus:
+            worker_counts.append(worker_counts[-1] * 2)
+        if worker_counts[-1] != cpus:
+            worker_counts.append(cpus)
+
+    reports = []
+    for workers in worker_counts:
+        report = measure_parallel_decode(path, workers=workers, **kwargs)
+        reports.append(report)
+        if verbose:
+            speedup = reports[0]["seconds"] / report["seconds"] if report["seconds"] else 0.0
+            print(f"workers={workers:<3} {report['packets_per_s']:>12,.0f} packets/s "
+                  f"{report['mb_per_s']:>8.2f} MB/s  x{speedup:.2f}")
+    return reports
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+huffman_bs_cli.py - Command line tool of the BombSquad Huffman codec
+
+Decodes or encodes a stream of packets read from hex dumps, length-prefixed
+binary files or pcap/pcapng captures, and writes JSONL, hex or binary
+records. huffman_bs.py runs this tool when it is given arguments.
+
+Usage:
+    # Decode a hex dump (one full packet per line) to JSONL
+    python huffman_bs.py decode packets.txt
+
+    # Decode the game packets of a capture, writing length-prefixed scene packets
+    python huffman_bs.py decode --input-format pcap --output-format binary -o scenes.bin session.pcapng
+
+    # Encode scene packets from stdin; a throughput summary goes to stderr
+    python huffman_bs.py encode --client-id 0x7c < scenes.txt
+"""
+
+import argparse
+import json
+import struct
+import sys
+import time
+
+from huffman_bs import (
+    BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED,
+    DECODE_ENGINES,
+    GAMEPACKET_TYPES,
+    HuffmanCodec,
+)
+from huffman_bs_capture import iter_udp_payloads
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+# Input formats of the command line tool ("binary" records are a 4-byte
+# little-endian length followed by the packet)
+CLI_INPUT_FORMATS = ("hex", "binary", "pcap")
+CLI_OUTPUT_FORMATS = ("jsonl", "hex", "binary")
+
+# Output records joined into a single write() by the command line tool
+CLI_WRITE_BATCH = 4096
+
+_U32 = struct.Struct("<I")
+
+
+def iter_hex_packets(stream):
+    """
+    Stream packets out of a text dump with one hex packet per line.
+
+    Bytes may be separated by whitespace; blank lines and lines starting
+    with "#" are skipped.
+
+    Args:
+        stream: Binary file object (e.g. sys.stdin.buffer)
+
+    Yields:
+        Packets as bytes
+
+    Raises:
+        ValueError: If a line is not valid hex
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith(b"#"):
+            continue
+        try:
+            yield bytes.fromhex(line.decode("ascii"))
+        except (UnicodeDecodeError, ValueError):
+            raise ValueError(f"Invalid hex on line {line_number}") from None
+
+
+def iter_length_prefixed(stream):
+    """
+    Stream packets out of a binary file of length-prefixed records.
+
+    Args:
+        stream: Binary file object (e.g. sys.stdin.buffer)
+
+    Yields:
+        Packets as bytes
+
+    Raises:
+        ValueError: If the stream ends inside a record
+    """
+    read = stream.read
+    while True:
+        prefix = read(4)
+        if not prefix:
+            return
+        if len(prefix) < 4:
+            raise ValueError("Truncated length prefix")
+        length = _U32.unpack(prefix)[0]
+        data = read(length)
+        if len(data) < length:
+            raise ValueError(f"Truncated record ({len(data)} of {length} bytes)")
+        yield data
+
+
+def _jsonl_error(index, error):
+    """Return the JSONL record of a packet that failed to decode or encode"""
+    return f'{{"index": {index}, "error": {json.dumps(str(error))}}}\n'.encode()
+
+
+def stream_packets(packets, out, mode="decode", output_format="jsonl", codec=None,
+                   client_id=0x7c, packet_type=BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED,
+                   max_output=None):
+    """
+    Decode or encode a stream of packets through one codec.
+
+    Output records are batched (see CLI_WRITE_BATCH) instead of written one
+    packet at a time.
+
+    In "decode" mode the inputs are full UDP packets: compressed game
+    packets are decompressed, other packet types are skipped. A JSONL
+    record is {"index", "type", "client_id", "scene"} or {"index", "error"};
+    hex and binary output hold only the scene packets that decoded.
+
+    In "encode" mode the inputs are scene packets, written as full packets
+    for client_id (JSONL records are {"index", "packet"}).
+
+    Args:
+        packets: Iterable of packets (bytes-like)
+        out: Binary file object to write to
+        mode: "decode" or "encode"
+        output_format: One of CLI_OUTPUT_FORMATS
+        codec: HuffmanCodec to use (default: a new one)
+        client_id, packet_type: Header of encoded packets
+        max_output: Largest scene packet to decompress (see
+            HuffmanCodec.decompress)
+
+    Returns:
+        Dict with packets, errors, skipped, bytes_in, bytes_out and seconds
+    """
+    if mode not in ("decode", "encode"):
+        raise ValueError(f"Unknown mode {mode!r}")
+    if output_format not in CLI_OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}")
+    if codec is None:
+        codec = HuffmanCodec()
+    decompress = codec.decompress
+    encode = codec.encode_full_packet
+    pack_length = _U32.pack
+
+    records = []
+    errors = skipped = bytes_in = bytes_out = 0
+    start = time.perf_counter()
+    index = -1
+    try:
+        for index, data in enumerate(packets):
+            bytes_in += len(data)
+            if mode == "decode":
+                if len(data) < 3 or data[0] not in GAMEPACKET_TYPES:
+                    skipped += 1
+                    continue
+                try:
+                    result = decompress(data[2:], max_output=max_output)
+                except (ValueError, IndexError) as e:
+                    errors += 1
+                    if output_format == "jsonl":
+                        records.append(_jsonl_error(index, e))
+                    continue
+                if output_format == "jsonl":
+                    record = (f'{{"index": {index}, "type": {data[0]}, "client_id": {data[1]}, '
+                              f'"scene": "{result.hex()}"}}\n').encode()
+            else:
+                try:
+                    result = encode(data, client_id, packet_type)
+                except ValueError as e:
+                    errors += 1
+                    if output_format == "jsonl":
+                        records.append(_jsonl_error(index, e))
+                    continue
+                if output_format == "jsonl":
+                    record = f'{{"index": {index}, "packet": "{result.hex()}"}}\n'.encode()
+
+            if output_format == "hex":
+                record = result.hex().encode() + b"\n"
+            elif output_format == "binary":
+                record = pack_length(len(result)) + result
+            bytes_out += len(result)
+            records.append(record)
+            if len(records) >= CLI_WRITE_BATCH:
+                out.write(b"".join(records))
+                records = []
+    finally:
+        # Keep the output of the packets read before an input error
+        if records:
+            out.write(b"".join(records))
+        out.flush()
+
+    return {
+        "packets": index + 1,
+        "errors": errors,
+        "skipped": skipped,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    """
+    Command line entry point: decode or encode packets from files or stdin.
+
+    Usage:
+        # Decode a hex dump (one full packet per line) to JSONL
+        python huffman_bs.py decode packets.txt
+
+        # Decode the game packets of a capture
+        python huffman_bs.py decode --input-format pcap session.pcapng
+
+        # Encode length-prefixed scene packets from stdin
+        python huffman_bs.py encode --input-format binary --output-format binary < scenes.bin
+
+    A throughput summary is printed to stderr.
+    """
+    parser = argparse.ArgumentParser(
+        prog="huffman_bs.py", description="Decode or encode BombSquad game packets")
+    parser.add_argument("mode", choices=("decode", "encode"))
+    parser.add_argument("inputs", nargs="*", default=["-"],
+                        help='input files ("-" for stdin, the default)')
+    parser.add_argument("--input-format", choices=CLI_INPUT_FORMATS, default="hex")
+    parser.add_argument("--output-format", choices=CLI_OUTPUT_FORMATS, default="jsonl")
+    parser.add_argument("--output", "-o", help="write to this file instead of stdout")
+    parser.add_argument("--engine", choices=DECODE_ENGINES, default="table",
+                        help="decode engine")
+    parser.add_argument("--client-id", type=lambda s: int(s, 0), default=0x7c,
+                        help="client id of encoded packets")
+    parser.add_argument("--packet-type", type=int, choices=GAMEPACKET_TYPES,
+                        default=BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED,
+                        help="packet type of encoded packets (36 = client to host, "
+                             "37 = host to client)")
+    parser.add_argument("--max-output", type=int,
+                        help="largest scene packet to decompress")
+    args = parser.parse_intermixed_args(argv)
+
+    if args.input_format == "pcap" and "-" in args.inputs:
+        parser.error("pcap input must be read from a file")
+
+    def packets():
+        for path in args.inputs:
+            if args.input_format == "pcap":
+                for payload in iter_udp_payloads(path, GAMEPACKET_TYPES):
+                    yield bytes(payload)
+                continue
+            stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+            try:
+                if args.input_format == "hex":
+                    yield from iter_hex_packets(stream)
+                else:
+                    yield from iter_length_prefixed(stream)
+            finally:
+                if stream is not sys.stdin.buffer:
+                    stream.close()
+
+    codec = HuffmanCodec(decode_engine=args.engine)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        summary = stream_packets(packets(), out, args.mode, args.output_format, codec,
+                                 client_id=args.client_id, packet_type=args.packet_type,
+                                 max_output=args.max_output)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    seconds = summary["seconds"]
+    print(f"{args.mode}d {summary['packets']} packets "
+          f"({summary['errors']} errors, {summary['skipped']} skipped), "
+          f"{summary['bytes_in']} -> {summary['bytes_out']} bytes in {seconds:.3f}s "
+          f"({summary['packets'] / seconds if seconds else 0:.0f} packets/s, "
+          f"{summary['bytes_in'] / seconds / 1e6 if seconds else 0:.1f} MB/s)",
+          file=sys.stderr)
+    return 0
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+if __name__ == "__main__":
+    sys.exit(main())
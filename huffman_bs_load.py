@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+huffman_bs_load.py - Synthetic multi-client load generator for BombSquad hosts
+
+Simulates many BombSquad clients, each with its own UDP socket and client_id,
+sending compressed game packets (input commands, keepalives, chat) at
+configurable rates to a target host. Scene packets come from
+huffman_bs.generate_scene_packet() and are encoded with
+HuffmanCodec.encode_full_packet(); by default every client's datagrams are
+encoded once up front and replayed, so the send loop does no codec work.
+With --live-encode every packet is encoded on the fly into a reused buffer
+instead, to measure the encode cost at the target rate.
+
+Usage:
+    # Run an echo server to point the generator at
+    python huffman_bs_load.py --echo 0.0.0.0:43210
+
+    # 200 clients for 10 seconds against a host (or the echo server)
+    python huffman_bs_load.py --target 127.0.0.1:43210 --clients 200 --duration 10
+
+    # Self-test against an in-process echo server
+    python huffman_bs_load.py --local-echo --clients 500 --input-rate 60
+
+The report (JSON on stdout) holds the achieved send rate, echoed replies
+received, datagrams dropped because the socket buffer was full, and the CPU
+time spent encoding per packet.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import sys
+import time
+
+import huffman_bs
+import huffman_bs_relay
+from huffman_bs import HuffmanCodec
+
+# Traffic each simulated client sends:
+# (kind, scene packet type, message type or None, (min size, max size))
+CLIENT_TRAFFIC = (
+    ("input", huffman_bs.BA_SCENEPACKET_MESSAGE_UNRELIABLE,
+     huffman_bs.BA_MESSAGE_REMOTE_PLAYER_INPUT_COMMANDS, (10, 24)),
+    ("keepalive", huffman_bs.BA_SCENEPACKET_KEEPALIVE, None, (3, 8)),
+    ("chat", huffman_bs.BA_SCENEPACKET_MESSAGE, huffman_bs.BA_MESSAGE_CHAT, (12, 80)),
+)
+
+# Default packets per second per client, by kind
+DEFAULT_RATES = {"input": 30.0, "keepalive": 1.0, "chat": 0.05}
+
+# Distinct scene packets generated per client and kind (replayed in turn)
+POOL_SIZE = 32
+
+# Seconds between send rounds
+TICK = 0.002
+
+# Printable bytes used for chat text
+CHAT_ALPHABET = b"abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,!?"
+
+
+def parse_addr(text):
+    """Parse 'host:port' into a (host, port) tuple"""
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def make_scene_packet(rng, scene_type, message_type, size_range):
+    """
+    Generate one scene packet of the given kind.
+
+    Returns:
+        Scene packet bytes
+    """
+    size = rng.randint(*size_range)
+    data = bytearray(huffman_bs.generate_scene_packet(rng, scene_type, size))
+    offset = huffman_bs.MESSAGE_TYPE_OFFSETS.get(scene_type)
+    if message_type is not None and offset is not None and size > offset:
+        data[offset] = message_type
+        if message_type == huffman_bs.BA_MESSAGE_CHAT:
+            data[offset + 1:] = bytes(rng.choice(CHAT_ALPHABET) for _ in range(size - offset - 1))
+    return bytes(data)
+
+
+# ============================================================================
+# LOAD GENERATOR
+# ============================================================================
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    """Counts what comes back to one simulated client's socket"""
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def datagram_received(self, data, addr):
+        self.generator.stats["received"] += 1
+
+    def error_received(self, exc):
+        self.generator.stats["send_errors"] += 1
+
+
+class _Client:
+    """One simulated client: transport, client_id and packet pools per kind"""
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.transport = None
+        self.pools = {}
+        self.next = {}
+
+
+class LoadGenerator:
+    """
+    Sends synthetic game traffic from many clients to one target.
+
+    Every client gets a connected UDP socket (so the target sees one peer
+    per client) and a client_id byte (client index modulo 256). Packets of
+    each kind are spread round-robin over the clients at rate * clients
+    packets per second in total.
+    """
+
+    def __init__(self, target, clients=100, rates=None, live_encode=False, seed=0,
+                 packet_type=huffman_bs.BA_PACKET_CLIENT_GAMEPACKET_COMPRESSED):
+        """
+        Args:
+            target: (host, port) to send to
+            clients: Number of simulated clients
+            rates: Packets per second per client by kind (default: DEFAULT_RATES)
+            live_encode: Encode every packet when sent instead of up front
+            seed: Random seed for the generated packets
+            packet_type: Packet type byte of every datagram
+        """
+        self.target = target
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self.live_encode = live_encode
+        self.packet_type = packet_type
+        self.codec = HuffmanCodec()
+        self.clients = [_Client(i & 0xFF) for i in range(clients)]
+        self.stats = {"sent": 0, "bytes": 0, "dropped": 0, "send_errors": 0, "received": 0,
+                      "encoded": 0, "encode_cpu_ns": 0}
+        self.sent_by_kind = dict.fromkeys(self.rates, 0)
+        self._prepare(random.Random(seed))
+
+    def _prepare(self, rng):
+        """Generate (and unless live_encode, encode) every client's packets"""
+        encode = self.codec.encode_full_packet
+        clock = time.process_time_ns
+        for client in self.clients:
+            for kind, scene_type, message_type, size_range in CLIENT_TRAFFIC:
+                if not self.rates.get(kind):
+                    continue
+                pool = [make_scene_packet(rng, scene_type, message_type, size_range)
+                        for _ in range(POOL_SIZE)]
+                if not self.live_encode:
+                    start = clock()
+                    pool = [encode(scene, client.client_id, self.packet_type) for scene in pool]
+                    self.stats["encode_cpu_ns"] += clock() - start
+                    self.stats["encoded"] += len(pool)
+                client.pools[kind] = pool
+                client.next[kind] = 0
+
+    async def open(self):
+        """Open one connected UDP socket per client"""
+        loop = asyncio.get_running_loop()
+        for client in self.clients:
+            client.transport, _ = await loop.create_datagram_endpoint(
+                lambda: _ClientProtocol(self), remote_addr=self.target,
+            )
+
+    def close(self):
+        """Close every client socket"""
+        for client in self.clients:
+            if client.transport is not None:
+                client.transport.close()
+                client.transport = None
+
+    def _send(self, client, kind, buffer):
+        """Send the next packet of kind from client"""
+        pool = client.pools[kind]
+        index = client.next[kind]
+        client.next[kind] = (index + 1) % len(pool)
+
+        if self.live_encode:
+            start = time.process_time_ns()
+            size = self.codec.encode_full_packet_into(
+                pool[index], buffer, client_id=client.client_id, packet_type=self.packet_type,
+            )
+            self.stats["encode_cpu_ns"] += time.process_time_ns() - start
+            self.stats["encoded"] += 1
+            data = memoryview(buffer)[:size]
+        else:
+            data = pool[index]
+
+        # Once the kernel buffer is full asyncio queues datagrams in user
+        # space; drop instead of letting that queue grow
+        transport = client.transport
+        if transport.get_write_buffer_size():
+            self.stats["dropped"] += 1
+            return
+        transport.sendto(data)
+        self.stats["sent"] += 1
+        self.stats["bytes"] += len(data)
+        self.sent_by_kind[kind] += 1
+
+    async def run(self, duration):
+        """
+        Send traffic for duration seconds.
+
+        Returns:
+            Report dict (see report())
+        """
+        loop = asyncio.get_running_loop()
+        buffer = bytearray(4096)
+        kinds = [kind for kind in self.rates if self.rates[kind] and self.clients]
+        due = dict.fromkeys(kinds, 0.0)
+        cursor = dict.fromkeys(kinds, 0)
+        client_count = len(self.clients)
+
+        cpu_start = time.process_time()
+        start = last = loop.time()
+        end = start + duration
+        while True:
+            now = loop.time()
+            if now >= end:
+                break
+            elapsed = now - last
+            last = now
+            for kind in kinds:
+                due[kind] += self.rates[kind] * client_count * elapsed
+                count = int(due[kind])
+                due[kind] -= count
+                index = cursor[kind]
+                for _ in range(count):
+                    self._send(self.clients[index], kind, buffer)
+                    index += 1
+                    if index == client_count:
+                        index = 0
+                cursor[kind] = index
+            await asyncio.sleep(TICK)
+
+        seconds = loop.time() - start
+        cpu_seconds = time.process_time() - cpu_start
+
+        # Give echoes of the last packets a moment to arrive
+        await asyncio.sleep(0.2)
+        return self.report(seconds, cpu_seconds)
+
+    def report(self, seconds, cpu_seconds):
+        """
+        Summarize a run.
+
+        Returns:
+            Dict with the achieved rate, bytes, drops, echoes received and the
+            encode CPU cost per packet (up-front or live)
+        """
+        stats = self.stats
+        encoded = stats["encoded"]
+        encode_seconds = stats["encode_cpu_ns"] / 1e9
+        return {
+            "clients": len(self.clients),
+            "seconds": seconds,
+            "target_packets_per_s": sum(self.rates.values()) * len(self.clients),
+            "packets_sent": stats["sent"],
+            "packets_per_s": stats["sent"] / seconds if seconds else 0.0,
+            "mbit_per_s": stats["bytes"] * 8 / seconds / 1e6 if seconds else 0.0,
+            "dropped": stats["dropped"],
+            "send_errors": stats["send_errors"],
+            "received": stats["received"],
+            "sent_by_kind": dict(self.sent_by_kind),
+            "cpu_seconds": cpu_seconds,
+            "encode": {
+                "mode": "live" if self.live_encode else "pre",
+                "packets": encoded,
+                "cpu_seconds": encode_seconds,
+                "cpu_us_per_packet": encode_seconds / encoded * 1e6 if encoded else 0.0,
+            },
+        }
+
+
+# ============================================================================
+# ECHO SERVER
+# ============================================================================
+
+class EchoProtocol(asyncio.DatagramProtocol):
+    """UDP server sending every datagram back to its sender"""
+
+    def __init__(self):
+        self.transport = None
+        self.received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        self.transport.sendto(data, addr)
+
+
+async def start_echo_server(addr):
+    """
+    Start an EchoProtocol server.
+
+    Returns:
+        Tuple of (transport, protocol); the bound address is
+        transport.get_extra_info("sockname")
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(EchoProtocol, local_addr=addr)
+    sock = transport.get_extra_info("socket")
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, huffman_bs_relay.RELAY_RECV_BUFFER)
+    except OSError:
+        pass
+    return transport, protocol
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+async def _main(args):
+    if args.echo:
+        transport, protocol = await start_echo_server(parse_addr(args.echo))
+        print(f"Echoing on {transport.get_extra_info('sockname')}", file=sys.stderr)
+        try:
+            await asyncio.sleep(args.duration if args.duration else float("inf"))
+        finally:
+            transport.close()
+        return 0
+
+    echo = None
+    target = parse_addr(args.target)
+    if args.local_echo:
+        echo, _ = await start_echo_server(("127.0.0.1", 0))
+        target = echo.get_extra_info("sockname")
+
+    rates = {"input": args.input_rate, "keepalive": args.keepalive_rate, "chat": args.chat_rate}
+    generator = LoadGenerator(target, args.clients, rates, live_encode=args.live_encode,
+                              seed=args.seed)
+    await generator.open()
+    try:
+        report = await generator.run(args.duration or 10.0)
+    finally:
+        generator.close()
+        if echo is not None:
+            echo.close()
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate BombSquad client load over UDP")
+    parser.add_argument("--target", default="127.0.0.1:43210", help="host:port to send to")
+    parser.add_argument("--clients", type=int, default=100, help="simulated clients")
+    parser.add_argument("--duration", type=float, help="seconds to run (default 10)")
+    parser.add_argument("--input-rate", type=float, default=DEFAULT_RATES["input"],
+                        help="input command packets per second per client")
+    parser.add_argument("--keepalive-rate", type=float, default=DEFAULT_RATES["keepalive"],
+                        help="keepalive packets per second per client")
+    parser.add_argument("--chat-rate", type=float, default=DEFAULT_RATES["chat"],
+                        help="chat packets per second per client")
+    parser.add_argument("--live-encode", action="store_true",
+                        help="encode every packet when sent instead of up front")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for generated packets")
+    parser.add_argument("--echo", metavar="HOST:PORT",
+                        help="run a UDP echo server instead of generating load")
+    parser.add_argument("--local-echo", action="store_true",
+                        help="send to an in-process echo server instead of --target")
+    args = parser.parse_args(argv)
+    return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
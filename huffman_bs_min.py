@@ -1,34 +1,92 @@
 Z = lambda _:[0]*_
 GF = lambda:[101342,9667,3497,1072,0,3793,0,0,2815,5235,*Z(3),3570,*Z(3),1383,*Z(3),2970,0,0,2857,*Z(8),1199,*Z(29),1494,1974,*Z(12),1351,*Z(113),1475,*Z(64)]
+# Huffman codes (bits incl. prefix, val) built from GF; every other byte is raw: 9 bits, val=byte<<1
+# Generated by huffman_bs.min_code_literal(); huffman_bs checks it against its own tree
+C = {0:(2,3),1:(4,1),2:(6,61),3:(8,73),5:(6,45),8:(6,21),9:(5,25),13:(6,13),17:(7,117),21:(6,29),24:(6,37),33:(7,9),63:(7,69),64:(6,41),77:(7,53),191:(7,5)}
+B = [9]*256; V = [i<<1 for i in range(256)]
+# 9-bit window -> (bits<<8)|byte, 0 = leave to the tree walk
+T = [(9<<8)|(w>>1) if not w&1 else 0 for w in range(512)]
+for x,(b,v) in C.items():
+    B[x]=b;V[x]=v
+    for k in range(1<<(9-b)):T[v|k<<b]=(b<<8)|x
+B = tuple(B); V = tuple(V); T = tuple(T)
 class N:
     def __init__(s):s.l=s.r=-1;s.p=s.b=s.v=s.f=0
+_n = None
+def TB():
+    # Full tree, only needed to decode malformed or truncated data
+    global _n
+    if _n:return _n
+    f = GF()
+    n=[N()for _ in range(511)];
+    for i in range(256):n[i].f=f[i]
+    c=256
+    while c<511:
+        i=0
+        while n[i].p!=0:i+=1
+        m1=i;i+=1
+        while n[i].p!=0:i+=1
+        m2=i;i+=1
+        while i<c:
+            if n[i].p==0:
+                if n[m1].f>n[m2].f:
+                    if n[i].f<n[m1].f:m1=i
+                else:
+                    if n[i].f<n[m2].f:m2=i
+            i+=1
+        n[c].f=n[m1].f+n[m2].f;n[m1].p=c-255;n[m2].p=c-255;n[c].r=m1;n[c].l=m2;c+=1
+    for i in range(256):n[i].b=B[i];n[i].v=V[i]
+    _n=n
+    return n
+_lr = None
+def LR():
+    # Child index tuples of the GF tree for W
+    global _lr
+    if not _lr:n=TB();_lr=(tuple(x.l for x in n),tuple(x.r for x in n))
+    return _lr
+# Kernels, also used by huffman_bs with its own tables
+def K(d,o,p,B=B,V=V):
+    # Write the codes of d into o from byte p (LSB first, 16-bit accumulator); returns end
+    a=k=0
+    for x in d:
+        a|=V[x]<<k;k+=B[x]
+        if k>=16:o[p]=a&255;o[p+1]=(a>>8)&255;a>>=16;k-=16;p+=2
+    while k>0:o[p]=a&255;a>>=8;k-=8;p+=1
+    return p
+def W(d,b,l,o,p,e,L,R):
+    # Tree walk from payload bit b of l into o[p:e]; returns (p,b)
+    while b<l and p<e:
+        v=(d[1+b//8]>>(b%8))&1;b+=1
+        if v:
+            n=510
+            while True:
+                v=(d[1+b//8]>>(b%8))&1
+                if v==0:
+                    if L[n]==-1:a=n;break
+                    n=L[n];b+=1
+                else:
+                    if R[n]==-1:a=n;break
+                    n=R[n];b+=1
+                if L[n]==-1 and R[n]==-1:a=n;break
+                if b>l:raise ValueError("Bit position exceeded bit_length during huffman decode")
+            o[p]=a&255;p+=1
+        else:
+            a=(d[1+b//8]>>(b%8))|(d[2+b//8]<<(8-b%8))if b%8 else d[1+b//8];o[p]=a&255;p+=1;b+=8
+            if b>l:raise ValueError("Bit position exceeded bit_length during raw read")
+    return p,b
+def D(d,b,l,o,p,e,T=T,L=None,R=None):
+    # Window table decode (len(T) = 2**window bits), W for the tail and unresolved windows
+    m=len(T)-1;j=l-m.bit_length()
+    for p in range(p,e):
+        if b>j:break
+        i=1+(b>>3);a=T[((d[i]|(d[i+1]<<8))>>(b&7))&m]
+        if not a:break
+        o[p]=a&255;b+=a>>8
+    else:return e,b
+    if L is None:L,R=LR()
+    return W(d,b,l,o,p,e,L,R)
 class HuffmanCodec:
-    def __init__(s):
-        f = GF()
-        s.n=[N()for _ in range(511)];
-        for i in range(256):s.n[i].f=f[i]
-        c=256
-        while c<511:
-            i=0
-            while s.n[i].p!=0:i+=1
-            m1=i;i+=1
-            while s.n[i].p!=0:i+=1
-            m2=i;i+=1
-            while i<c:
-                if s.n[i].p==0:
-                    if s.n[m1].f>s.n[m2].f:
-                        if s.n[i].f<s.n[m1].f:m1=i
-                    else:
-                        if s.n[i].f<s.n[m2].f:m2=i
-                i+=1
-            s.n[c].f=s.n[m1].f+s.n[m2].f;s.n[m1].p=c-255;s.n[m2].p=c-255;s.n[c].r=m1;s.n[c].l=m2;c+=1
-        for i in range(256):
-            s.n[i].v=s.n[i].b=0;j=i
-            while s.n[j].p!=0:
-                p=s.n[j].p+255;s.n[i].v=(s.n[i].v<<1)|(0x01 if s.n[p].r==j else 0);s.n[i].b+=1;j=p
-            if s.n[i].b>=8:s.n[i].b=8;s.n[i].v=i<<1
-            else:s.n[i].v=(s.n[i].v<<1)|0x01
-            s.n[i].b+=1
+    n = property(lambda s:TB())
     def w(s,o,p,v,b):
         i=0
         while i<b:
@@ -40,10 +98,9 @@ class HuffmanCodec:
     def c(s,d):
         if not d:return bytes()
         if d[0]&0x80:raise ValueError("First byte high bit set")
-        t=sum(s.n[b].b for b in d);l=(t+7)//8+1;r=t%8
+        t=sum(map(B.__getitem__,d));l=(t+7)//8+1;r=t%8
         if l>=len(d):return d
-        o=[0];p=8
-        for b in d:p=s.w(o,p,s.n[b].v,s.n[b].b)
+        o=bytearray(l);K(d,o,1)
         o[0]=((8-r%8)if r else 0)|0x80
         return bytes(o)
     def d(s,d):
@@ -52,24 +109,6 @@ class HuffmanCodec:
         if not z:return d
         l=(len(d)-1)*8
         if r>l:raise ValueError("Invalid")
-        l-=r;o=[];b=0;f=1
-        while b<l:
-            v=(d[f+b//8]>>(b%8))&1;b+=1
-            if v:
-                n=510
-                while True:
-                    v=(d[f+b//8]>>(b%8))&1
-                    if v==0:
-                        if s.n[n].l==-1:a=n;break
-                        else:n=s.n[n].l;b+=1
-                    else:
-                        if s.n[n].r==-1:a=n;break
-                        else:n=s.n[n].r;b+=1
-                    if s.n[n].l==-1 and s.n[n].r==-1:a=n;break
-                    if b>l:raise ValueError("Overflow")
-                o.append(a&0xFF)
-            else:
-                a=(d[f+b//8]>>(b%8))|(d[f+b//8+1]<<(8-b%8))if b%8!=0 else d[f+b//8];o.append(a&0xFF);b+=8
-                if b>l:raise ValueError("Overflow")
-        return bytes(o)
+        l-=r;o=bytearray((l>>1)+1);p,_=D(d,0,l,o,0,len(o))
+        return bytes(o[:p])
     def e(s,d,i=0x7c):return bytes([36,i])+s.c(d)
@@ -0,0 +1,248 @@
+"""
+huffman_bs_relay.py - Asyncio UDP relay for BombSquad game packets
+
+Forwards datagrams between BombSquad clients and a host, giving every client
+its own socket towards the host. Compressed game packets passing through are
+decompressed with huffman_bs.HuffmanCodec and handed to hooks that can
+inspect, rewrite or drop the scene packets. Lives apart from huffman_bs so
+importing the codec doesn't load asyncio.
+
+Usage:
+    from huffman_bs_relay import GamePacketRelay, RELAY_TO_HOST
+
+    def log_to_host(direction, client_addr, scene_packet):
+        if direction == RELAY_TO_HOST:
+            print(client_addr, scene_packet.hex())
+        return scene_packet
+
+    relay = GamePacketRelay(("203.0.113.5", 43210), hooks=[log_to_host])
+    await relay.start("0.0.0.0", 43210)
+"""
+
+import asyncio
+import collections
+import socket
+
+from huffman_bs import GAMEPACKET_TYPES, HuffmanCodec
+
+# Directions passed to relay hooks
+RELAY_TO_HOST = "to_host"
+RELAY_TO_CLIENT = "to_client"
+
+# Default receive buffer of the relay's listening socket (bytes)
+RELAY_RECV_BUFFER = 4 * 1024 * 1024
+
+# Default limit on concurrent client sessions (each holds a host-side socket)
+RELAY_MAX_SESSIONS = 1024
+
+
+class _RelaySession:
+    """Relay state for one client address"""
+    def __init__(self, client_addr):
+        self.client_addr = client_addr
+        self.transport = None     # Host-side transport once connected
+        self.pending = []         # Datagrams received before connecting
+        self.last_seen = 0.0      # Loop time of last datagram (either way)
+
+
+class _RelayClientProtocol(asyncio.DatagramProtocol):
+    """Listening socket receiving datagrams from clients"""
+    def __init__(self, relay):
+        self.relay = relay
+
+    def datagram_received(self, data, addr):
+        self.relay._from_client(data, addr)
+
+
+class _RelayHostProtocol(asyncio.DatagramProtocol):
+    """Per-client socket connected to the host"""
+    def __init__(self, relay, session):
+        self.relay = relay
+        self.session = session
+
+    def datagram_received(self, data, addr):
+        self.relay._from_host(data, self.session)
+
+
+class GamePacketRelay:
+    """
+    Asyncio UDP relay between BombSquad clients and a host.
+
+    Every client address gets its own socket towards the host, so the host
+    sees one peer per client as usual. Compressed game packets passing
+    through are decompressed, handed to the hooks and re-encoded with
+    encode_full_packet() using the original packet type and client ID.
+    All other packets are forwarded untouched.
+
+    Hooks are called as hook(direction, client_addr, scene_packet) with
+    direction RELAY_TO_HOST or RELAY_TO_CLIENT. A hook returns the scene
+    packet to forward (the same object if unchanged) or None to drop the
+    packet. Hooks run on the event loop and must not block. If a hook
+    raises, or returns something encode_full_packet() rejects (not bytes,
+    or a first byte with the high bit set), the packet is dropped and
+    counted in stats["hook_errors"].
+
+    Datagrams from new client addresses are dropped (counted in
+    stats["session_limit"]) while max_sessions sessions are open, so
+    spoofed source addresses can't exhaust file descriptors.
+
+    Usage:
+        relay = GamePacketRelay(("203.0.113.5", 43210), hooks=[my_hook])
+        await relay.start("0.0.0.0", 43210)
+        ...
+        relay.close()
+    """
+
+    def __init__(self, host_addr, hooks=(), codec=None, idle_timeout=60.0,
+                 recv_buffer=RELAY_RECV_BUFFER, max_scene_packet=None,
+                 max_sessions=RELAY_MAX_SESSIONS):
+        """
+        Args:
+            host_addr: (host, port) of the game host to relay to
+            hooks: Callables run on every decompressed scene packet
+            codec: HuffmanCodec to use (default: a new one)
+            idle_timeout: Seconds without traffic before a client session is closed
+            recv_buffer: Receive buffer size of the listening socket, so bursts
+                from many clients aren't dropped by the kernel (None = OS default)
+            max_scene_packet: Largest decompressed scene packet handed to the
+                hooks; decoding larger ones is aborted early and they are
+                forwarded untouched like undecodable packets (None = no limit)
+            max_sessions: Most client sessions open at once
+        """
+        self.host_addr = host_addr
+        self.hooks = list(hooks)
+        self.codec = codec if codec is not None else HuffmanCodec()
+        self.idle_timeout = idle_timeout
+        self.recv_buffer = recv_buffer
+        self.max_scene_packet = max_scene_packet
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.stats = collections.Counter()
+        self.transport = None
+        self._loop = None
+        self._reaper = None
+
+    async def start(self, listen_host="0.0.0.0", listen_port=43210):
+        """
+        Start listening for clients.
+
+        Returns:
+            (host, port) the relay is listening on
+        """
+        self._loop = asyncio.get_running_loop()
+        self.transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _RelayClientProtocol(self),
+            local_addr=(listen_host, listen_port),
+        )
+        if self.recv_buffer:
+            sock = self.transport.get_extra_info("socket")
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+            except OSError:
+                pass
+        self._reaper = self._loop.create_task(self._reap_idle_sessions())
+        return self.transport.get_extra_info("sockname")[:2]
+
+    def close(self):
+        """Stop listening and close all client sessions"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for session in self.sessions.values():
+            if session.transport is not None:
+                session.transport.close()
+        self.sessions.clear()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def process(self, data, direction, client_addr):
+        """
+        Run the hooks over one datagram.
+
+        Returns:
+            Datagram to forward, or None to drop it
+        """
+        if len(data) < 3 or data[0] not in GAMEPACKET_TYPES or not self.hooks:
+            return data
+
+        try:
+            scene_packet = self.codec.decompress(data[2:], max_output=self.max_scene_packet)
+        except (ValueError, IndexError):
+            self.stats["decode_errors"] += 1
+            return data
+
+        original = scene_packet
+        try:
+            for hook in self.hooks:
+                scene_packet = hook(direction, client_addr, scene_packet)
+                if scene_packet is None:
+                    self.stats["dropped"] += 1
+                    return None
+
+            if scene_packet is original:
+                return data
+            data = self.codec.encode_full_packet(scene_packet, client_id=data[1],
+                                                 packet_type=data[0])
+        except Exception:
+            self.stats["hook_errors"] += 1
+            return None
+        self.stats["rewritten"] += 1
+        return data
+
+    def _from_client(self, data, client_addr):
+        self.stats["from_client"] += 1
+        session = self.sessions.get(client_addr)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                self.stats["session_limit"] += 1
+                return
+            session = self.sessions[client_addr] = _RelaySession(client_addr)
+            self._loop.create_task(self._connect(session))
+        session.last_seen = self._loop.time()
+
+        data = self.process(data, RELAY_TO_HOST, client_addr)
+        if data is None:
+            return
+        if session.transport is None:
+            session.pending.append(data)
+        else:
+            session.transport.sendto(data)
+
+    def _from_host(self, data, session):
+        self.stats["from_host"] += 1
+        session.last_seen = self._loop.time()
+
+        data = self.process(data, RELAY_TO_CLIENT, session.client_addr)
+        if data is not None and self.transport is not None:
+            self.transport.sendto(data, session.client_addr)
+
+    async def _connect(self, session):
+        try:
+            transport, _ = await self._loop.create_datagram_endpoint(
+                lambda: _RelayHostProtocol(self, session),
+                remote_addr=self.host_addr,
+            )
+        except OSError:
+            self.stats["connect_errors"] += 1
+            self.sessions.pop(session.client_addr, None)
+            return
+
+        if self.sessions.get(session.client_addr) is not session:
+            # Closed while connecting
+            transport.close()
+            return
+        session.transport = transport
+        for data in session.pending:
+            transport.sendto(data)
+        session.pending = []
+
+    async def _reap_idle_sessions(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 0.1))
+            deadline = self._loop.time() - self.idle_timeout
+            for addr, session in list(self.sessions.items()):
+                if session.last_seen < deadline:
+                    del self.sessions[addr]
+                    if session.transport is not None:
+                        session.transport.close()
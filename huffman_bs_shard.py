@@ -0,0 +1,432 @@
+"""
+huffman_bs_shard.py - Multi-core decoding of live traffic, sharded by client
+
+ClientShardDispatcher hands incoming game packets to worker processes
+through single-producer shared-memory ring buffers (ShardRing). Every client
+ID maps to one worker, so a client's packets are decompressed and handled
+in arrival order while different clients are decoded on different cores.
+
+Usage:
+    # Handler runs in the workers: handle_scene_packet(client_id, packet_type, scene_packet)
+    with ClientShardDispatcher(workers=4, handler=handle_scene_packet) as dispatcher:
+        while True:
+            data, addr = sock.recvfrom(65535)
+            dispatcher.dispatch(data)
+"""
+
+import collections
+import multiprocessing
+import multiprocessing.shared_memory
+import os
+import struct
+import time
+
+from huffman_bs import GAMEPACKET_TYPES, HuffmanCodec
+
+# ============================================================================
+# CLIENT SHARDING
+# ============================================================================
+
+# Default data capacity of each worker's ShardRing (bytes)
+SHARD_RING_BYTES = 4 * 1024 * 1024
+
+# Longest a shard worker blocks waiting for a record before checking
+# whether its ring was closed
+SHARD_WAIT_TIMEOUT = 0.1
+
+# First and longest sleep of dispatch() while waiting for ring space (the
+# sleep doubles between retries)
+SHARD_POLL_INTERVAL = 0.0001
+SHARD_MAX_POLL_INTERVAL = 0.005
+
+# Length prefix marking the rest of the ring as unused (record wrapped around)
+_RING_WRAP = 0xFFFFFFFF
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+
+class ShardRing:
+    """
+    Single-producer single-consumer ring buffer of datagrams in shared memory.
+
+    A 64-byte header of uint64 counters is followed by the data area. Each
+    record is a 4-byte length and the datagram, padded to 8 bytes; a record
+    that doesn't fit before the end of the data area starts over at its
+    beginning.
+
+    Records are copied in and out without a lock, but the header is only
+    read and written under a multiprocessing.Lock: the producer publishes a
+    new head, and the consumer a new tail, after storing or copying the
+    record, and the lock orders those stores on every CPU architecture. A
+    semaphore counts the records, so an idle consumer blocks in get()
+    instead of polling.
+
+    Pickles by shared memory name together with its lock and semaphore, so
+    a worker process started with the ring as an argument attaches to the
+    same buffer (under any start method).
+    """
+
+    # Header field offsets
+    _HEAD = 0            # Bytes ever written
+    _TAIL = 8            # Bytes ever consumed
+    _WRITTEN = 16        # Records ever written
+    _READ = 24           # Records ever consumed
+    _DECODE_ERRORS = 32  # Records the consumer failed to decompress
+    _HANDLER_ERRORS = 40 # Records whose handler raised
+    _CLOSED = 48         # Set by the producer when no more records follow
+    _CAPACITY = 56       # Size of the data area
+    _HEADER_SIZE = 64
+
+    def __init__(self, capacity=SHARD_RING_BYTES, name=None):
+        """
+        Args:
+            capacity: Data area size in bytes (rounded up to a multiple of 8)
+            name: Name of an existing ring's shared memory to attach to
+                instead of creating a new one
+        """
+        # Only the creating process frees the memory (a forked worker
+        # inherits this object as is)
+        self.owner = name is None
+        self._owner_pid = os.getpid()
+        if self.owner:
+            capacity = (capacity + 7) & ~7
+            self.shm = multiprocessing.shared_memory.SharedMemory(
+                create=True, size=self._HEADER_SIZE + capacity
+            )
+            self.shm.buf[:self._HEADER_SIZE] = bytes(self._HEADER_SIZE)
+            _U64.pack_into(self.shm.buf, self._CAPACITY, capacity)
+            self._lock = multiprocessing.Lock()
+            self._records = multiprocessing.Semaphore(0)
+        else:
+            self.shm = multiprocessing.shared_memory.SharedMemory(name=name)
+            capacity = _U64.unpack_from(self.shm.buf, self._CAPACITY)[0]
+            self._lock = self._records = None  # Set by _attach_ring()
+        self.capacity = capacity
+        self._header = self.shm.buf[:self._HEADER_SIZE]
+        self._data = self.shm.buf[self._HEADER_SIZE:self._HEADER_SIZE + capacity]
+
+    def __reduce__(self):
+        return _attach_ring, (self.shm.name, self._lock, self._records)
+
+    def _get(self, field):
+        with self._lock:
+            return _U64.unpack_from(self._header, field)[0]
+
+    def _increment(self, field):
+        with self._lock:
+            _U64.pack_into(self._header, field, _U64.unpack_from(self._header, field)[0] + 1)
+
+    @property
+    def depth(self):
+        """Records written but not consumed yet"""
+        with self._lock:
+            return (_U64.unpack_from(self._header, self._WRITTEN)[0]
+                    - _U64.unpack_from(self._header, self._READ)[0])
+
+    @property
+    def depth_bytes(self):
+        """Bytes of the data area in use"""
+        with self._lock:
+            return (_U64.unpack_from(self._header, self._HEAD)[0]
+                    - _U64.unpack_from(self._header, self._TAIL)[0])
+
+    @property
+    def read(self):
+        """Records consumed so far"""
+        return self._get(self._READ)
+
+    @property
+    def decode_errors(self):
+        """Records the consumer failed to decompress"""
+        return self._get(self._DECODE_ERRORS)
+
+    @property
+    def handler_errors(self):
+        """Records whose handler raised in the consumer"""
+        return self._get(self._HANDLER_ERRORS)
+
+    @property
+    def closed(self):
+        """True once the producer called mark_closed()"""
+        return bool(self._get(self._CLOSED))
+
+    def mark_closed(self):
+        """Tell the consumer no more records follow (and wake it up)"""
+        with self._lock:
+            _U64.pack_into(self._header, self._CLOSED, 1)
+        self._records.release()
+
+    def put(self, data):
+        """
+        Append one record (producer side).
+
+        Returns:
+            True if stored, False if the ring is too full
+
+        Raises:
+            ValueError: If data can never fit the ring
+        """
+        size = (4 + len(data) + 7) & ~7
+        if size > self.capacity // 2:
+            raise ValueError(f"Record of {len(data)} bytes too large for ring")
+
+        header = self._header
+        with self._lock:
+            head = _U64.unpack_from(header, self._HEAD)[0]
+            tail = _U64.unpack_from(header, self._TAIL)[0]
+        pos = head % self.capacity
+        skip = self.capacity - pos if pos + size > self.capacity else 0
+        if head + skip + size - tail > self.capacity:
+            return False
+
+        data_area = self._data
+        if skip:
+            _U32.pack_into(data_area, pos, _RING_WRAP)
+            pos = 0
+        _U32.pack_into(data_area, pos, len(data))
+        data_area[pos + 4:pos + 4 + len(data)] = data
+
+        # Publish the record only after it has been stored
+        with self._lock:
+            _U64.pack_into(header, self._HEAD, head + skip + size)
+            _U64.pack_into(header, self._WRITTEN, _U64.unpack_from(header, self._WRITTEN)[0] + 1)
+        self._records.release()
+        return True
+
+    def get(self, timeout=0.0):
+        """
+        Take the oldest record (consumer side).
+
+        Args:
+            timeout: Seconds to block waiting for a record (None = until
+                one arrives or the ring is closed)
+
+        Returns:
+            Record bytes, or None if the ring is (still) empty
+        """
+        if not self._records.acquire(True, timeout):
+            return None
+        header = self._header
+        with self._lock:
+            tail = _U64.unpack_from(header, self._TAIL)[0]
+            head = _U64.unpack_from(header, self._HEAD)[0]
+        if tail == head:
+            # Woken up by mark_closed()
+            return None
+
+        data_area = self._data
+        pos = tail % self.capacity
+        length = _U32.unpack_from(data_area, pos)[0]
+        if length == _RING_WRAP:
+            tail += self.capacity - pos
+            pos = 0
+            length = _U32.unpack_from(data_area, pos)[0]
+        data = bytes(data_area[pos + 4:pos + 4 + length])
+
+        # Free the space only after the record has been copied out
+        with self._lock:
+            _U64.pack_into(header, self._TAIL, tail + ((4 + length + 7) & ~7))
+            _U64.pack_into(header, self._READ, _U64.unpack_from(header, self._READ)[0] + 1)
+        return data
+
+    def close(self):
+        """Detach from the shared memory (and free it, if this ring created it)"""
+        self._header.release()
+        self._data.release()
+        self.shm.close()
+        if self.owner and os.getpid() == self._owner_pid:
+            self.shm.unlink()
+
+
+def _attach_ring(name, lock, records):
+    """Unpickle a ShardRing: attach to its shared memory and synchronization"""
+    ring = ShardRing(name=name)
+    ring._lock = lock
+    ring._records = records
+    return ring
+
+
+def _shard_worker(ring, handler, decode_engine, freqs, max_output):
+    """
+    Shard worker process: decompress and handle every datagram of one ring.
+
+    Runs until the ring is closed and drained, then detaches from it.
+    """
+    codec = HuffmanCodec(decode_engine=decode_engine, freqs=freqs)
+    try:
+        while True:
+            data = ring.get(SHARD_WAIT_TIMEOUT)
+            if data is None:
+                if ring.closed and ring.depth == 0:
+                    break
+                continue
+
+            try:
+                scene_packet = codec.decompress(data[2:], max_output=max_output)
+            except (ValueError, IndexError):
+                ring._increment(ring._DECODE_ERRORS)
+                continue
+            if handler is not None:
+                try:
+                    handler(data[1], data[0], scene_packet)
+                except Exception:
+                    ring._increment(ring._HANDLER_ERRORS)
+    finally:
+        ring.close()
+
+
+class ClientShardDispatcher:
+    """
+    Spreads incoming game packets over worker processes by client ID.
+
+    The receiving process calls dispatch() with every datagram. Compressed
+    game packets are routed by their client_id byte (the byte after the
+    packet type, as written by encode_full_packet()) to worker
+    client_id % workers, through that worker's ShardRing. Every client
+    always lands on the same worker, so its packets are decompressed and
+    handled in order, while codec work for different clients runs on
+    different cores.
+
+    Each worker decompresses its packets and calls
+    handler(client_id, packet_type, scene_packet). The handler runs in the
+    worker process, so it must be picklable (a module-level function) and
+    report results through its own channel.
+
+    When a worker falls behind, its ring fills up and dispatch() waits up
+    to its timeout for space, then drops the packet (counted per worker).
+
+    Usage:
+        with ClientShardDispatcher(workers=4, handler=handle_scene_packet) as dispatcher:
+            for _ in range(100000):
+                data, addr = sock.recvfrom(65535)
+                dispatcher.dispatch(data)
+            print(dispatcher.metrics())
+    """
+
+    def __init__(self, workers=None, handler=None, ring_bytes=SHARD_RING_BYTES,
+                 decode_engine="table", freqs=None, max_output=None):
+        """
+        Args:
+            workers: Number of worker processes (default: os.cpu_count())
+            handler: Callable run on every decompressed scene packet in the
+                workers, or None to only decompress
+            ring_bytes: Data capacity of each worker's ring
+            decode_engine, freqs: Codec options of the workers' codecs
+            max_output: Largest scene packet the workers decompress (see
+                HuffmanCodec.decompress())
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.handler = handler
+        self.decode_engine = decode_engine
+        self.freqs = freqs
+        self.max_output = max_output
+        self.rings = [ShardRing(ring_bytes) for _ in range(self.workers)]
+        self.shard_of = [client_id % self.workers for client_id in range(256)]
+        self.worker_stats = [collections.Counter() for _ in range(self.workers)]
+        self.stats = collections.Counter()
+        self.processes = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start the worker processes"""
+        for ring in self.rings:
+            process = multiprocessing.Process(
+                target=_shard_worker,
+                args=(ring, self.handler, self.decode_engine, self.freqs, self.max_output),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    def dispatch(self, data, timeout=0.0):
+        """
+        Queue one datagram for its client's worker.
+
+        Args:
+            data: Received datagram
+            timeout: Seconds to wait for ring space before dropping the packet
+
+        Returns:
+            True if queued; False if dropped or not a game packet with a
+            payload (counted in stats["skipped"])
+        """
+        if len(data) < 3 or data[0] not in GAMEPACKET_TYPES:
+            self.stats["skipped"] += 1
+            return False
+
+        index = self.shard_of[data[1]]
+        ring = self.rings[index]
+        stats = self.worker_stats[index]
+        if not ring.put(data):
+            deadline = time.monotonic() + timeout
+            interval = SHARD_POLL_INTERVAL
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    stats["dropped"] += 1
+                    return False
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, SHARD_MAX_POLL_INTERVAL)
+                if ring.put(data):
+                    break
+            stats["waited"] += 1
+
+        stats["dispatched"] += 1
+        depth = ring.depth
+        if depth > stats["max_depth"]:
+            stats["max_depth"] = depth
+        return True
+
+    def metrics(self):
+        """
+        Per-worker queue and throughput counters.
+
+        Returns:
+            List with one dict per worker: depth (packets queued now),
+            depth_bytes, max_depth (highest depth seen by dispatch()),
+            dispatched, waited (packets queued after waiting for space),
+            dropped, processed, decode_errors, handler_errors, alive
+        """
+        result = []
+        for index, ring in enumerate(self.rings):
+            stats = self.worker_stats[index]
+            process = self.processes[index] if index < len(self.processes) else None
+            result.append({
+                "depth": ring.depth,
+                "depth_bytes": ring.depth_bytes,
+                "max_depth": stats["max_depth"],
+                "dispatched": stats["dispatched"],
+                "waited": stats["waited"],
+                "dropped": stats["dropped"],
+                "processed": ring.read,
+                "decode_errors": ring.decode_errors,
+                "handler_errors": ring.handler_errors,
+                "alive": process is not None and process.is_alive(),
+            })
+        return result
+
+    def close(self, timeout=None):
+        """
+        Let the workers drain their rings, stop them and free the rings.
+
+        Args:
+            timeout: Seconds to wait for each worker (None = until drained);
+                workers still running afterwards are terminated
+        """
+        for ring in self.rings:
+            ring.mark_closed()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = []
+        for ring in self.rings:
+            ring.close()
+        self.rings = []